@@ -48,12 +48,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    "shop_app.timing.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    # Before SessionMiddleware so session saves are counted
+    "shop_app.metrics.DatabaseWriteMetricsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "shop_app.cart.CartCookieMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "social_django.middleware.SocialAuthExceptionMiddleware",
 ]
@@ -62,7 +67,8 @@ ROOT_URLCONF = "Shop_project.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates that reports render time to shop_app.timing
+        "BACKEND": "shop_app.timing.DjangoTemplates",
         "DIRS": [TEMPLATE_DIR,],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -72,6 +78,7 @@ TEMPLATES = [
                 "django.contrib.messages.context_processors.messages",
                 "social_django.context_processors.backends",
                 "social_django.context_processors.login_redirect",
+                "shop_app.context_processors.cart_summary",
             ],
         },
     },
@@ -91,6 +98,75 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# SHOP_CACHE_BACKEND selects locmem (default), file or redis. The redis
+# backend speaks the Redis protocol (Redis, Valkey, KeyDB...) and needs the
+# redis package; tests can point it at fakeredis through OPTIONS.
+
+SHOP_CACHE_BACKEND = os.environ.get('SHOP_CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "shop",
+    },
+    'file': {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get('SHOP_CACHE_LOCATION', '/var/tmp/shop_cache'),
+    },
+    'redis': {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get('SHOP_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+    },
+}
+
+CACHES = {
+    "default": {
+        **CACHE_BACKENDS[SHOP_CACHE_BACKEND],
+        "KEY_PREFIX": "shop",
+        "TIMEOUT": int(os.environ.get('SHOP_CACHE_TIMEOUT', 300)),
+    }
+}
+
+# shop_app.cart.CookieCartBackend keeps anonymous carts in a signed cookie
+# instead of Cart/CartItem rows until the shopper logs in.
+SHOP_CART_BACKEND = os.environ.get('SHOP_CART_BACKEND', 'shop_app.cart.DatabaseCartBackend')
+
+# Anonymous carts idle this long are deleted by the cleanup_carts command
+SHOP_ABANDONED_CART_DAYS = int(os.environ.get('SHOP_ABANDONED_CART_DAYS', 30))
+
+# Seconds the home page context is cached; catalog changes invalidate it sooner
+SHOP_HOME_CACHE_TIMEOUT = int(os.environ.get('SHOP_HOME_CACHE_TIMEOUT', 60 * 15))
+
+# Content-based "similar products" (shop_app.recommendations): saves are
+# refreshed in one background batch this many seconds after the first change,
+# against the TF-IDF index the build_recommendations command stores here.
+SHOP_SIMILAR_REFRESH_DELAY = float(os.environ.get('SHOP_SIMILAR_REFRESH_DELAY', 5))
+SHOP_SIMILARITY_INDEX_PATH = os.environ.get('SHOP_SIMILARITY_INDEX_PATH', str(BASE_DIR / 'similarity_index.npz'))
+
+# Per-request timings (shop_app.timing): the fraction of requests that are
+# instrumented and logged, the duration above which a request is logged as a
+# warning, and whether the timings are sent in a Server-Timing header.
+SHOP_TIMING_SAMPLE_RATE = float(os.environ.get('SHOP_TIMING_SAMPLE_RATE', 1.0))
+SHOP_TIMING_SLOW_MS = float(os.environ.get('SHOP_TIMING_SLOW_MS', 500))
+SHOP_TIMING_HEADER = os.environ.get('SHOP_TIMING_HEADER', str(DEBUG)).lower() in ('1', 'true', 'yes')
+
+# shop_app loggers (timings, DB write metrics) go to the console at this level
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "shop_app": {
+            "handlers": ["console"],
+            "level": os.environ.get('SHOP_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -134,6 +210,17 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads are stored under content-hash names (see shop_app.storage), so media
+# URLs can be cached forever; set SHOP_MEDIA_STORAGE to opt out.
+STORAGES = {
+    "default": {
+        "BACKEND": os.environ.get('SHOP_MEDIA_STORAGE', 'shop_app.storage.HashedFileSystemStorage'),
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -76,3 +76,10 @@ class ReviewAdmin(admin.ModelAdmin):
     list_filter = ['rating', 'created_at']
     search_fields = ['product__name', 'user__username', 'comment']
     readonly_fields = ['created_at']
+
+@admin.register(ProductRecommendation)
+class ProductRecommendationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'kind', 'rank', 'recommended', 'score']
+    list_filter = ['kind']
+    search_fields = ['product__name', 'recommended__name']
+    raw_id_fields = ['product', 'recommended']
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ShopAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "shop_app"
+
+    def ready(self):
+        from . import signals  # noqa: F401
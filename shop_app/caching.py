@@ -0,0 +1,34 @@
+"""
+Versioned cache keys for catalog-derived data.
+
+Keys built with ``catalog_cache_key`` embed the current catalog version, so
+bumping the version when products, images or categories change makes every
+older entry unreachable at once without having to know or delete the keys.
+"""
+import time
+
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'catalog_version'
+
+def _initial_version():
+    # Start from the clock so an evicted version key never reuses old numbers
+    return int(time.time() * 1000)
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, _initial_version(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+def bump_catalog_version():
+    """Invalidate every catalog_cache_key() entry"""
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, _initial_version(), None)
+        return cache.get(CATALOG_VERSION_KEY)
+
+def catalog_cache_key(name):
+    return f'{name}:v{get_catalog_version()}'
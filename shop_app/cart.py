@@ -0,0 +1,473 @@
+"""
+Shopping cart storage.
+
+Views talk to the cart through a backend from ``get_cart_backend()``, picked
+with the ``SHOP_CART_BACKEND`` setting (a dotted path to a backend class):
+
+* ``DatabaseCartBackend`` (default) keeps every cart in Cart/CartItem rows,
+  keyed by user or session.
+* ``CookieCartBackend`` keeps anonymous carts in a compact signed cookie and
+  only writes Cart/CartItem rows once the shopper logs in (checkout requires
+  a login). Signed-in users are served from the database as usual.
+
+Every backend method has an async twin (``aadd_item``, ``asummary``, ...)
+for the async cart views; they use the async ORM, session and cache APIs
+and ``request.auser()``, so they never block the event loop on a query.
+
+``CartCookieMiddleware`` writes the cookie changes a backend makes.
+"""
+import hashlib
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.http import Http404
+from django.utils.module_loading import import_string
+
+from .caching import catalog_cache_key
+from .models import Cart, CartItem, Product, primary_image_prefetch
+from .pricing import acart_totals, cart_totals, line_totals, priced_cart_items, priced_products
+
+CART_SUMMARY_TIMEOUT = 60 * 60  # Refreshed on every cart mutation anyway
+
+# Session entry naming the anonymous cart; it survives the session key change at login
+CART_SESSION_KEY = 'shop_cart_id'
+
+EMPTY_CART_SUMMARY = cart_totals(None)
+
+class CartError(Exception):
+    """A cart change that cannot be made, the message is shown to the customer"""
+
+def get_or_create_cart(request):
+    """Return the visitor's cart, saving a new cart (and session) if needed; only for mutations"""
+    if request.user.is_authenticated:
+        cart, created = Cart.objects.get_or_create(user=request.user)
+    else:
+        session_key = request.session.session_key
+        if not session_key:
+            request.session.create()
+            session_key = request.session.session_key
+        cart, created = Cart.objects.get_or_create(session_key=session_key, user=None)
+        if request.session.get(CART_SESSION_KEY) != cart.pk:
+            request.session[CART_SESSION_KEY] = cart.pk
+    return cart
+
+async def aget_or_create_cart(request):
+    """Async get_or_create_cart()"""
+    user = await request.auser()
+    if user.is_authenticated:
+        cart, created = await Cart.objects.aget_or_create(user=user)
+    else:
+        if not request.session.session_key:
+            await request.session.acreate()
+        cart, created = await Cart.objects.aget_or_create(session_key=request.session.session_key, user=None)
+        if await request.session.aget(CART_SESSION_KEY) != cart.pk:
+            await request.session.aset(CART_SESSION_KEY, cart.pk)
+    return cart
+
+def get_existing_cart(request):
+    """Return the visitor's cart without creating a cart or a session"""
+    if request.user.is_authenticated:
+        return Cart.objects.filter(user=request.user).first()
+    session_key = request.session.session_key
+    if not session_key:
+        return None
+    return Cart.objects.filter(session_key=session_key, user=None).first()
+
+async def aget_existing_cart(request):
+    """Async get_existing_cart()"""
+    user = await request.auser()
+    if user.is_authenticated:
+        return await Cart.objects.filter(user=user).afirst()
+    session_key = request.session.session_key
+    if not session_key:
+        return None
+    return await Cart.objects.filter(session_key=session_key, user=None).afirst()
+
+def get_cart(request):
+    """Return the visitor's cart for reading, or an unsaved empty cart without touching the database"""
+    cart = get_existing_cart(request)
+    if cart is None:
+        cart = Cart(user=request.user if request.user.is_authenticated else None)
+    return cart
+
+def cart_summary_cache_key(request, user=None):
+    """Cache key for the visitor's cart summary, or None if they have no cart yet
+
+    Async callers pass the user from ``request.auser()``; with a logged-in
+    user the request is not used.
+    """
+    user = request.user if user is None else user
+    if user.is_authenticated:
+        return f'cart_summary:user:{user.pk}'
+    session_key = request.session.session_key
+    if session_key:
+        return f'cart_summary:session:{session_key}'
+    return None
+
+def compute_cart_summary(cart):
+    """Item count, quantity total and pricing for a cart"""
+    return cart_totals(cart)
+
+def get_cart_summary(request):
+    """Cached cart summary for the current visitor"""
+    return get_cart_backend().summary(request)
+
+def refresh_cart_summary(request, cart):
+    """Recompute and store the cart summary after the cart was changed"""
+    summary = compute_cart_summary(cart)
+    key = cart_summary_cache_key(request)
+    if key is not None:
+        cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+async def arefresh_cart_summary(request, cart):
+    """Async refresh_cart_summary()"""
+    summary = await acart_totals(cart)
+    key = cart_summary_cache_key(request, await request.auser())
+    if key is not None:
+        await cache.aset(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+def merge_cart_lines(user, lines):
+    """Add (product_id, size, quantity) lines to the user's cart with a single upsert
+
+    Lines for the same product and size are combined with each other and
+    with what the cart already holds. Returns the user's cart.
+    """
+    cart, created = Cart.objects.get_or_create(user=user)
+    quantities = Counter()
+    for product_id, size, quantity in lines:
+        quantities[product_id, size] += quantity
+    if not quantities:
+        return cart
+    if not created:
+        for product_id, size, quantity in cart.items.filter(
+            product_id__in={product_id for product_id, size in quantities}
+        ).values_list('product_id', 'size', 'quantity'):
+            if (product_id, size) in quantities:
+                quantities[product_id, size] += quantity
+
+    CartItem.objects.bulk_create(
+        [
+            CartItem(cart=cart, product_id=product_id, size=size, quantity=quantity)
+            for (product_id, size), quantity in quantities.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['cart', 'product', 'size'],
+        update_fields=['quantity'],
+    )
+    # Logged-in users' keys do not depend on the request
+    cache.delete(cart_summary_cache_key(None, user))
+    return cart
+
+class DatabaseCartBackend:
+    """Carts stored as Cart/CartItem rows"""
+
+    def items(self, request):
+        """Priced cart lines with their products, for rendering"""
+        return priced_cart_items(get_cart(request)).select_related('product__category').prefetch_related(
+            primary_image_prefetch('product__images')
+        )
+
+    def summary(self, request, refresh=False):
+        """Cached cart totals, recomputed when refresh is true"""
+        if refresh:
+            return refresh_cart_summary(request, get_existing_cart(request))
+        key = cart_summary_cache_key(request)
+        if key is None:
+            return dict(EMPTY_CART_SUMMARY)
+
+        summary = cache.get(key)
+        if summary is None:
+            summary = compute_cart_summary(get_existing_cart(request))
+            cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+        return summary
+
+    async def asummary(self, request, refresh=False):
+        if refresh:
+            return await arefresh_cart_summary(request, await aget_existing_cart(request))
+        key = cart_summary_cache_key(request, await request.auser())
+        if key is None:
+            return dict(EMPTY_CART_SUMMARY)
+
+        summary = await cache.aget(key)
+        if summary is None:
+            summary = await acart_totals(await aget_existing_cart(request))
+            await cache.aset(key, summary, CART_SUMMARY_TIMEOUT)
+        return summary
+
+    def add_item(self, request, product, quantity, size):
+        """Add quantity of product in size, returns the new summary"""
+        cart = get_or_create_cart(request)
+        cart_item, created = CartItem.objects.get_or_create(
+            cart=cart, product=product, size=size, defaults={'quantity': quantity},
+        )
+        if not created:
+            # In the database, so concurrent adds to the same line are not lost
+            CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + quantity)
+        return refresh_cart_summary(request, cart)
+
+    def update_item(self, request, item_id, quantity):
+        """Set a line's quantity, removing it when quantity is not positive"""
+        cart = get_existing_cart(request)
+        cart_item = self._get_item(cart, item_id)
+        if quantity <= 0:
+            cart_item.delete()
+        else:
+            cart_item.quantity = quantity
+            cart_item.save()
+        return refresh_cart_summary(request, cart)
+
+    def remove_item(self, request, item_id):
+        cart = get_existing_cart(request)
+        self._get_item(cart, item_id).delete()
+        return refresh_cart_summary(request, cart)
+
+    async def aadd_item(self, request, product, quantity, size):
+        cart = await aget_or_create_cart(request)
+        cart_item, created = await CartItem.objects.aget_or_create(
+            cart=cart, product=product, size=size, defaults={'quantity': quantity},
+        )
+        if not created:
+            await CartItem.objects.filter(pk=cart_item.pk).aupdate(quantity=F('quantity') + quantity)
+        return await arefresh_cart_summary(request, cart)
+
+    async def aupdate_item(self, request, item_id, quantity):
+        cart = await aget_existing_cart(request)
+        lines = self._item_lines(cart, item_id)
+        if quantity <= 0:
+            changed, per_model = await lines.adelete()
+        else:
+            changed = await lines.aupdate(quantity=quantity)
+        if not changed:
+            raise Http404('Cart item not found')
+        return await arefresh_cart_summary(request, cart)
+
+    async def aremove_item(self, request, item_id):
+        cart = await aget_existing_cart(request)
+        deleted, per_model = await self._item_lines(cart, item_id).adelete()
+        if not deleted:
+            raise Http404('Cart item not found')
+        return await arefresh_cart_summary(request, cart)
+
+    def login(self, request, user):
+        """Merge the anonymous session cart into the user's cart and delete it"""
+        cart_id = request.session.pop(CART_SESSION_KEY, None)
+        if cart_id is None:
+            return
+        with transaction.atomic():
+            anonymous_cart = Cart.objects.select_for_update().filter(pk=cart_id, user=None).first()
+            if anonymous_cart is None:
+                return
+            merge_cart_lines(user, anonymous_cart.items.values_list('product_id', 'size', 'quantity'))
+            anonymous_cart.delete()
+
+    def _get_item(self, cart, item_id):
+        try:
+            return CartItem.objects.get(id=item_id, cart=cart)
+        except (CartItem.DoesNotExist, ValueError):
+            raise Http404('Cart item not found')
+
+    def _item_lines(self, cart, item_id):
+        try:
+            return CartItem.objects.filter(id=item_id, cart=cart)
+        except ValueError:
+            raise Http404('Cart item not found')
+
+class CookieCartLine:
+    """A cookie cart line shaped like a priced CartItem for the cart templates"""
+
+    def __init__(self, product, size, quantity):
+        self.id = CookieCartBackend.line_id(product.pk, size)
+        self.product = product
+        self.size = size
+        self.quantity = quantity
+        self.unit_price = product.unit_price
+        self.line_total = self.unit_price * quantity
+
+class CookieCartBackend(DatabaseCartBackend):
+    """Anonymous carts in a signed cookie of [product_id, size, quantity] lines"""
+
+    cookie_name = 'shop_cart'
+    salt = 'shop_app.cart'
+    max_age = 60 * 60 * 24 * 30
+    max_lines = 30
+    max_quantity = 99
+    # Stay well below the ~4KB browsers allow per cookie
+    max_cookie_bytes = 2048
+
+    @staticmethod
+    def line_id(product_id, size):
+        return f'{product_id}:{size}'
+
+    def read_lines(self, request):
+        """The cookie's lines, or [] when it is missing, tampered with or expired"""
+        if not hasattr(request, '_cart_lines'):
+            lines = []
+            value = request.COOKIES.get(self.cookie_name)
+            if value:
+                try:
+                    lines = [
+                        [int(product_id), str(size), int(quantity)]
+                        for product_id, size, quantity in signing.loads(value, salt=self.salt, max_age=self.max_age)
+                    ]
+                except (signing.BadSignature, TypeError, ValueError):
+                    lines = []
+            request._cart_lines = [line for line in lines if line[2] > 0]
+        return request._cart_lines
+
+    def write_lines(self, request, lines):
+        value = signing.dumps(lines, salt=self.salt, compress=True) if lines else None
+        if value is not None and len(value) > self.max_cookie_bytes:
+            raise CartError('Your cart is full. Please log in to add more items.')
+        request._cart_lines = lines
+        request._cart_cookie = (self.cookie_name, value, self.max_age)
+
+    def items(self, request):
+        if request.user.is_authenticated:
+            return super().items(request)
+        lines = self.read_lines(request)
+        if not lines:
+            return []
+        products = priced_products(Product.objects.filter(is_active=True))
+        products = products.select_related('category').prefetch_related(primary_image_prefetch()).in_bulk(
+            {product_id for product_id, size, quantity in lines}
+        )
+        return [
+            CookieCartLine(products[product_id], size, quantity)
+            for product_id, size, quantity in lines if product_id in products
+        ]
+
+    def summary(self, request, refresh=False):
+        if request.user.is_authenticated:
+            return super().summary(request, refresh)
+        lines = self.read_lines(request)
+        if not lines:
+            return dict(EMPTY_CART_SUMMARY)
+
+        # Keyed by the cart contents and the catalog version, so price changes are picked up
+        digest = hashlib.md5(repr(lines).encode()).hexdigest()
+        key = catalog_cache_key(f'cart_summary:cookie:{digest}')
+        summary = cache.get(key)
+        if summary is None:
+            summary = line_totals(self.items(request))
+            cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+        return summary
+
+    def add_item(self, request, product, quantity, size):
+        if request.user.is_authenticated:
+            return super().add_item(request, product, quantity, size)
+        lines = [list(line) for line in self.read_lines(request)]
+        for line in lines:
+            if line[0] == product.pk and line[1] == size:
+                line[2] = min(line[2] + quantity, self.max_quantity)
+                break
+        else:
+            if len(lines) >= self.max_lines:
+                raise CartError('Your cart is full. Please log in to add more items.')
+            lines.append([product.pk, size, min(quantity, self.max_quantity)])
+        self.write_lines(request, lines)
+        return self.summary(request)
+
+    def update_item(self, request, item_id, quantity):
+        if request.user.is_authenticated:
+            return super().update_item(request, item_id, quantity)
+        lines = [list(line) for line in self.read_lines(request)]
+        index = self._find_line(lines, item_id)
+        if quantity <= 0:
+            del lines[index]
+        else:
+            lines[index][2] = min(quantity, self.max_quantity)
+        self.write_lines(request, lines)
+        return self.summary(request)
+
+    def remove_item(self, request, item_id):
+        if request.user.is_authenticated:
+            return super().remove_item(request, item_id)
+        lines = [list(line) for line in self.read_lines(request)]
+        del lines[self._find_line(lines, item_id)]
+        self.write_lines(request, lines)
+        return self.summary(request)
+
+    # Cookie carts need no I/O beyond the product lookup in summary(), so the
+    # anonymous path reuses the sync methods on a worker thread
+    async def asummary(self, request, refresh=False):
+        if (await request.auser()).is_authenticated:
+            return await super().asummary(request, refresh)
+        return await sync_to_async(self.summary)(request, refresh)
+
+    async def aadd_item(self, request, product, quantity, size):
+        if (await request.auser()).is_authenticated:
+            return await super().aadd_item(request, product, quantity, size)
+        return await sync_to_async(self.add_item)(request, product, quantity, size)
+
+    async def aupdate_item(self, request, item_id, quantity):
+        if (await request.auser()).is_authenticated:
+            return await super().aupdate_item(request, item_id, quantity)
+        return await sync_to_async(self.update_item)(request, item_id, quantity)
+
+    async def aremove_item(self, request, item_id):
+        if (await request.auser()).is_authenticated:
+            return await super().aremove_item(request, item_id)
+        return await sync_to_async(self.remove_item)(request, item_id)
+
+    def login(self, request, user):
+        """Materialize the cookie cart into the user's database cart and drop the cookie"""
+        super().login(request, user)
+        lines = self.read_lines(request)
+        if not lines:
+            return
+        active_ids = set(Product.objects.filter(
+            is_active=True, id__in={product_id for product_id, size, quantity in lines}
+        ).values_list('id', flat=True))
+        merge_cart_lines(user, [line for line in lines if line[0] in active_ids])
+        self.write_lines(request, [])
+
+    def _find_line(self, lines, item_id):
+        for index, (product_id, size, quantity) in enumerate(lines):
+            if self.line_id(product_id, size) == str(item_id):
+                return index
+        raise Http404('Cart item not found')
+
+def get_cart_backend():
+    """Return the configured cart backend"""
+    backend_path = getattr(settings, 'SHOP_CART_BACKEND', None)
+    backend_class = import_string(backend_path) if backend_path else DatabaseCartBackend
+    return backend_class()
+
+class CartCookieMiddleware:
+    """Set or delete the cart cookie when a cart backend changed it during the request"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.write_cookie(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.write_cookie(request, await self.get_response(request))
+
+    def write_cookie(self, request, response):
+        cookie = getattr(request, '_cart_cookie', None)
+        if cookie is not None:
+            name, value, max_age = cookie
+            if value is None:
+                response.delete_cookie(name, samesite='Lax')
+            else:
+                response.set_cookie(
+                    name, value, max_age=max_age, httponly=True, samesite='Lax',
+                    secure=settings.SESSION_COOKIE_SECURE,
+                )
+        return response
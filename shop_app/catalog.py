@@ -0,0 +1,103 @@
+from django.db.models import Q
+
+from .models import Product
+from .search import get_search_backend
+
+PRODUCTS_PER_PAGE = 12
+REVIEWS_PER_PAGE = 10
+
+# Sort option -> ordering; every ordering ends in id so pages are stable
+SORT_ORDERINGS = {
+    'newest': ('-created_at', '-id'),
+    'price_low': ('price', 'id'),
+    'price_high': ('-price', '-id'),
+    'name': ('name', 'id'),
+    'top_rated': ('-rating_average', '-id'),
+}
+
+def get_param(params, name):
+    """A product_list parameter without surrounding whitespace, '' when missing
+
+    Filters, search and the facet cache key all read parameters through
+    this, so equivalent queries get the same results and cache entries.
+    """
+    return params.get(name, '').strip()
+
+def product_filters(params):
+    """Q objects for each active product_list filter, keyed by the facet they narrow"""
+    filters = {}
+    
+    # Category filter
+    category_slug = get_param(params, 'category')
+    if category_slug:
+        filters['category'] = Q(category__slug=category_slug)
+    
+    # Gender filter
+    gender = get_param(params, 'gender')
+    if gender:
+        filters['gender'] = Q(gender=gender)
+    
+    # Size filter, matched against the JSON text of available_sizes
+    size = get_param(params, 'size')
+    if size:
+        filters['size'] = Q(available_sizes__icontains=f'"{size}"')
+    
+    # Price filter
+    price = Q()
+    min_price = get_param(params, 'min_price')
+    max_price = get_param(params, 'max_price')
+    if min_price:
+        price &= Q(price__gte=min_price)
+    if max_price:
+        price &= Q(price__lte=max_price)
+    if price:
+        filters['price'] = price
+    
+    return filters
+
+def search_products(params, products=None):
+    """Active products narrowed by the search query only"""
+    if products is None:
+        products = Product.objects.for_listing()
+    products = products.filter(is_active=True)
+    search_query = get_param(params, 'search')
+    if search_query:
+        products = get_search_backend().search(products, search_query)
+    return products
+
+def filter_products(params):
+    """Apply the product_list search and filter parameters.
+
+    Returns the filtered, sorted listing queryset and the normalized filter
+    values for the template.
+    """
+    products = search_products(params)
+    for condition in product_filters(params).values():
+        products = products.filter(condition)
+    
+    # Sort products
+    search_query = get_param(params, 'search')
+    sort_by = get_param(params, 'sort') or ('relevance' if search_query else 'newest')
+    products = sort_products(products, sort_by, search_query)
+    
+    filters = {
+        'search_query': search_query,
+        'current_category': get_param(params, 'category'),
+        'current_gender': get_param(params, 'gender'),
+        'current_size': get_param(params, 'size'),
+        'min_price': get_param(params, 'min_price'),
+        'max_price': get_param(params, 'max_price'),
+        'sort_by': sort_by,
+    }
+    return products, filters
+
+def sort_products(products, sort_by, search_query=''):
+    if sort_by == 'relevance' and search_query:
+        return products.order_by('-search_rank', '-created_at', '-id')
+    return products.order_by(*SORT_ORDERINGS.get(sort_by, SORT_ORDERINGS['newest']))
+
+def nearby_page_numbers(page_obj, on_each_side=2):
+    """Page links around the current page, without walking the whole page_range"""
+    first = max(1, page_obj.number - on_each_side)
+    last = min(page_obj.paginator.num_pages, page_obj.number + on_each_side)
+    return range(first, last + 1)
@@ -0,0 +1,312 @@
+"""
+Streaming product import from CSV or JSON Lines files.
+
+``python manage.py import_catalog`` feeds files of any size through a chain
+of generators: rows are read one at a time, parsed into unsaved Product
+instances (categories are resolved by slug from a map loaded once) and
+upserted by slug with ``bulk_create(update_conflicts=True)``, one chunk per
+transaction. Memory use depends on the chunk size, not the file size.
+
+A row only changes the fields it has, so a feed with just ``slug`` and
+``stock`` updates stock levels. Empty CSV cells count as missing, except
+``sale_price``, where an empty cell ends the sale. New products need at
+least a name, a category and a price. Rows that cannot be imported are
+reported with their line number and skipped.
+
+Signal handlers do not run for bulk upserts, so once the import is done
+the products whose name, description or category changed are re-indexed
+for search (the whole index is rebuilt after big imports) and the catalog
+version is bumped.
+"""
+import csv
+import gzip
+import io
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import bump_catalog_version
+from .models import Category, Product
+from .pricing import CENTS
+from .search import get_search_backend
+
+DEFAULT_CHUNK_SIZE = 1000
+
+FORMATS = ('csv', 'jsonl')
+
+REQUIRED_FOR_NEW = ('name', 'category', 'price')
+
+# Fields in the search index, and how many changed products are re-indexed
+# one by one before rebuilding the whole index is cheaper
+SEARCH_FIELDS = {'name', 'description', 'category'}
+REINDEX_LIMIT = 10_000
+
+SIZE_LABELS = dict(Product.SIZES)
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'n'}
+
+class ImportRowError(Exception):
+    """A row that cannot be imported, the message says why"""
+
+class ImportResult:
+    """Rows read, written and rejected by one import, and how long it took"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+def detect_format(path):
+    """'csv' or 'jsonl' from the file name, ignoring a .gz suffix"""
+    name = path.lower().removesuffix('.gz')
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise ValueError(f'Cannot tell the format of {path}, pass --format')
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path), encoding='utf-8-sig', newline='')
+    return open(path, encoding='utf-8-sig', newline='')
+
+def read_rows(path, file_format):
+    """Yield (line number, row dict) from a CSV or JSON Lines file; JSON errors are yielded as ImportRowError"""
+    with open_text(path) as file:
+        if file_format == 'csv':
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, ImportRowError(f'Invalid JSON: {e}')
+                continue
+            if not isinstance(row, dict):
+                row = ImportRowError('Expected a JSON object')
+            yield line_number, row
+
+def is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+def parse_decimal(name, value):
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ImportRowError(f'{name} is not a number: {value!r}')
+    if not number.is_finite() or number < 0 or number >= 10 ** 8:
+        raise ImportRowError(f'{name} is out of range: {value!r}')
+    return number.quantize(CENTS)
+
+def parse_bool(name, value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ImportRowError(f'{name} is not a boolean: {value!r}')
+
+def parse_sizes(value):
+    """A JSON list of [code, label] pairs or codes, or codes separated by |"""
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith('['):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise ImportRowError(f'available_sizes is not valid JSON: {value!r}')
+        else:
+            value = [code.strip() for code in value.split('|') if code.strip()]
+    if not isinstance(value, list):
+        raise ImportRowError('available_sizes must be a list')
+    sizes = []
+    for size in value:
+        if isinstance(size, str):
+            size = [size, SIZE_LABELS.get(size, size)]
+        if not (isinstance(size, list) and len(size) == 2 and all(isinstance(part, str) for part in size)):
+            raise ImportRowError(f'Invalid size: {size!r}')
+        sizes.append(size)
+    return sizes
+
+def parse_product(row, categories):
+    """Turn a row into (unsaved Product, names of the fields the row sets)"""
+    slug = str(row.get('slug') or '').strip()
+    try:
+        validate_slug(slug)
+    except ValidationError:
+        raise ImportRowError(f'Invalid slug: {slug!r}')
+
+    values = {}
+    for name in ('name', 'description'):
+        if not is_blank(row.get(name)):
+            values[name] = str(row[name]).strip()
+    if len(values.get('name', '')) > Product._meta.get_field('name').max_length:
+        raise ImportRowError('name is too long')
+
+    if not is_blank(row.get('category')):
+        category_slug = str(row['category']).strip()
+        if category_slug not in categories:
+            raise ImportRowError(f'Unknown category: {category_slug!r}')
+        values['category_id'] = categories[category_slug]
+
+    if not is_blank(row.get('price')):
+        values['price'] = parse_decimal('price', row['price'])
+    if 'sale_price' in row:
+        values['sale_price'] = None if is_blank(row['sale_price']) else parse_decimal('sale_price', row['sale_price'])
+        if values['sale_price'] is not None and 'price' in values and values['sale_price'] >= values['price']:
+            raise ImportRowError('sale_price must be lower than price')
+
+    if not is_blank(row.get('stock')):
+        try:
+            values['stock'] = int(str(row['stock']).strip())
+        except ValueError:
+            raise ImportRowError(f'stock is not a whole number: {row["stock"]!r}')
+        if values['stock'] < 0:
+            raise ImportRowError('stock cannot be negative')
+
+    if not is_blank(row.get('available_sizes')):
+        values['available_sizes'] = parse_sizes(row['available_sizes'])
+    if not is_blank(row.get('gender')):
+        values['gender'] = str(row['gender']).strip().upper()
+        if values['gender'] not in dict(Product.GENDERS):
+            raise ImportRowError(f'Invalid gender: {row["gender"]!r}')
+    for name in ('is_active', 'is_featured'):
+        if not is_blank(row.get(name)):
+            values[name] = parse_bool(name, row[name])
+
+    return Product(slug=slug, **values), {name.removesuffix('_id') for name in values}
+
+def parse_rows(rows, categories, on_error):
+    """Yield (Product, fields) for every valid row, passing (line number, row, message) of the others to on_error"""
+    for line_number, row in rows:
+        try:
+            if isinstance(row, ImportRowError):
+                raise row
+            yield parse_product(row, categories)
+        except ImportRowError as e:
+            on_error(line_number, row, str(e))
+
+def chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def upsert_chunk(chunk, dry_run=False):
+    """Upsert one chunk of (Product, fields) by slug
+
+    Returns (created, updated, rejected, reindex): rejected lists the slugs of
+    new products missing required fields, reindex the products whose
+    searchable fields were written.
+    """
+    # The last row for a slug wins
+    by_slug = {product.slug: (product, fields) for product, fields in chunk}
+    existing = dict(Product.objects.filter(slug__in=list(by_slug)).values_list('slug', 'id'))
+    rejected = [
+        slug for slug, (product, fields) in by_slug.items()
+        if slug not in existing and not fields.issuperset(REQUIRED_FOR_NEW)
+    ]
+    for slug in rejected:
+        del by_slug[slug]
+
+    # Rows with the same columns are written together, so each row only updates its own fields
+    groups = {}
+    for product, fields in by_slug.values():
+        complete = fields.issuperset(REQUIRED_FOR_NEW)
+        if not complete:
+            product.pk = existing[product.slug]
+        groups.setdefault((complete, frozenset(fields)), []).append(product)
+    if not dry_run:
+        now = timezone.now()
+        with transaction.atomic():
+            for (complete, fields), products in groups.items():
+                # updated_at feeds the conditional GET validators
+                update_fields = sorted(fields) + ['updated_at']
+                if complete:
+                    Product.objects.bulk_create(
+                        products, update_conflicts=True, unique_fields=['slug'], update_fields=update_fields,
+                    )
+                else:
+                    # The INSERT half of an upsert would fail NOT NULL checks
+                    # before the conflict is seen, so partial rows update by pk
+                    for product in products:
+                        product.updated_at = now
+                    Product.objects.bulk_update(products, update_fields)
+    updated = len(existing.keys() & by_slug.keys())
+    reindex = [] if dry_run else [product for product, fields in by_slug.values() if fields & SEARCH_FIELDS]
+    return len(by_slug) - updated, updated, rejected, reindex
+
+def import_products(paths, file_format=None, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False,
+                    on_error=None, on_progress=None):
+    """Import product files, returns an ImportResult
+
+    on_error(path, line number, row, message) is called for every rejected
+    row and on_progress(result) after every chunk.
+    """
+    result = ImportResult()
+    categories = dict(Category.objects.values_list('slug', 'id'))
+    reindex, rebuild = [], False
+    started = time.monotonic()
+
+    for path in paths:
+        line_numbers = {}
+
+        def reject(line_number, row, message):
+            result.errors += 1
+            if on_error:
+                on_error(path, line_number, row, message)
+
+        def numbered(rows):
+            for line_number, row in rows:
+                result.rows += 1
+                if not isinstance(row, ImportRowError):
+                    line_numbers[str(row.get('slug') or '').strip()] = line_number
+                yield line_number, row
+
+        rows = numbered(read_rows(path, file_format or detect_format(path)))
+        for chunk in chunks(parse_rows(rows, categories, reject), chunk_size):
+            created, updated, rejected, changed = upsert_chunk(chunk, dry_run)
+            result.created += created
+            result.updated += updated
+            if not rebuild:
+                reindex.extend(changed)
+                rebuild = len(reindex) > REINDEX_LIMIT
+            for slug in rejected:
+                reject(line_numbers.get(slug), None, f'New product {slug!r} needs {", ".join(REQUIRED_FOR_NEW)}')
+            line_numbers.clear()
+            result.seconds = time.monotonic() - started
+            if on_progress:
+                on_progress(result)
+
+    if rebuild:
+        get_search_backend().rebuild()
+    else:
+        backend = get_search_backend()
+        for product in reindex:
+            backend.index_product(product)
+    if not dry_run and result.created + result.updated:
+        bump_catalog_version()
+    result.seconds = time.monotonic() - started
+    return result
@@ -0,0 +1,151 @@
+"""
+Batched deletion of abandoned carts, expired sessions and unreferenced media.
+
+Rows are deleted in short transactions over bounded primary-key windows, so
+no single statement holds the write lock (the whole database on SQLite) for
+long. Used by ``python manage.py cleanup_carts`` and ``cleanup_media``.
+"""
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .images import stored_derivatives
+from .models import Cart, Category, ProductImage
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Media directories whose files belong to these (model, image field, derivatives field)s
+MEDIA_REFERENCES = {
+    'products': (ProductImage, 'image', 'derivatives'),
+    'categories': (Category, 'image', 'image_derivatives'),
+}
+
+class CleanupResult:
+    """Rows deleted by one cleanup step, and how long it took"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+def abandoned_carts(days):
+    """Anonymous carts with no activity for the given number of days"""
+    cutoff = timezone.now() - timedelta(days=days)
+    # Adding items does not touch Cart.updated_at, so recent lines keep a cart alive
+    return Cart.objects.filter(user=None, updated_at__lt=cutoff).exclude(items__added_at__gte=cutoff)
+
+def delete_in_pk_batches(queryset, batch_size=DEFAULT_BATCH_SIZE, pause=0):
+    """Delete queryset rows one primary-key window at a time, each window in its own transaction
+
+    Related rows (cart items for carts) are removed with their window.
+    """
+    result = CleanupResult(queryset.model._meta.verbose_name_plural)
+    bounds = queryset.order_by().aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return result
+
+    started = time.monotonic()
+    low = bounds['low']
+    while low <= bounds['high']:
+        with transaction.atomic():
+            deleted, per_model = queryset.filter(pk__gte=low, pk__lt=low + batch_size).delete()
+        result.rows += deleted
+        result.batches += 1
+        low += batch_size
+        if pause and deleted:
+            time.sleep(pause)
+    result.seconds = time.monotonic() - started
+    return result
+
+def delete_expired_sessions(batch_size=DEFAULT_BATCH_SIZE, pause=0):
+    """Delete expired database sessions in batches; other session engines clean up their own way"""
+    result = CleanupResult('sessions')
+    started = time.monotonic()
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    if not issubclass(store, DatabaseSessionStore):
+        store.clear_expired()
+    else:
+        # Session keys are strings, so walk the expire_date index instead of key ranges
+        session_model = store.get_model_class()
+        expired = session_model.objects.filter(expire_date__lt=timezone.now())
+        while True:
+            keys = list(expired.order_by('expire_date').values_list('pk', flat=True)[:batch_size])
+            if not keys:
+                break
+            with transaction.atomic():
+                deleted, per_model = session_model.objects.filter(pk__in=keys).delete()
+            result.rows += deleted
+            result.batches += 1
+            if pause:
+                time.sleep(pause)
+    result.seconds = time.monotonic() - started
+    return result
+
+def free_space_bytes():
+    """Bytes the database can reuse, or None if the backend does not say
+
+    On SQLite this is the freelist, which grows as rows are deleted; on
+    PostgreSQL it is the dead-tuple estimate that VACUUM will reclaim for the
+    cart and session tables.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA freelist_count')
+            pages = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_size')
+            return pages * cursor.fetchone()[0]
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT COALESCE(SUM(pg_total_relation_size(relid) * n_dead_tup "
+                "/ GREATEST(n_live_tup + n_dead_tup, 1)), 0) "
+                "FROM pg_stat_user_tables "
+                "WHERE relname IN ('shop_app_cart', 'shop_app_cartitem', 'django_session')"
+            )
+            return int(cursor.fetchone()[0])
+    return None
+
+def referenced_media_names():
+    """Every stored name an image field or its derivatives record points at"""
+    names = set()
+    for model, field_name, record_field in MEDIA_REFERENCES.values():
+        rows = model.objects.exclude(**{field_name: ''}).values_list(field_name, record_field)
+        for name, record in rows.iterator(chunk_size=DEFAULT_BATCH_SIZE):
+            if name:
+                names.add(name)
+            for image_format in (record or {}).get('formats', {}):
+                names.update(name for width, name in stored_derivatives(record, image_format))
+    return names
+
+def walk_storage(directory, storage=None):
+    """Yield every file name below a storage directory"""
+    storage = storage or default_storage
+    if not storage.exists(directory):
+        return
+    subdirectories, files = storage.listdir(directory)
+    for filename in files:
+        yield f'{directory}/{filename}'
+    for subdirectory in subdirectories:
+        yield from walk_storage(f'{directory}/{subdirectory}', storage)
+
+def unreferenced_media(min_age, storage=None):
+    """Yield (name, size) of media files older than min_age that no model references"""
+    storage = storage or default_storage
+    referenced = referenced_media_names()
+    cutoff = timezone.now() - min_age
+    for directory in MEDIA_REFERENCES:
+        for name in walk_storage(directory, storage):
+            # Young files may belong to an upload whose row is not committed yet
+            if name not in referenced and storage.get_modified_time(name) < cutoff:
+                yield name, storage.size(name)
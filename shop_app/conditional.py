@@ -0,0 +1,91 @@
+"""
+Validators for conditional GETs of catalog and order pages.
+
+Each page gets an ETag built from the timestamps of what it shows (the
+product, its stock and its latest review, the category and its newest product, the
+order), the catalog version (navigation, related products), the query
+string and the viewer: who is logged in and what the cart badge says. A
+matching If-None-Match is answered with a 304 before the view renders.
+
+Last-Modified is only sent for the public version of catalog pages, the one
+anonymous visitors with an empty cart see, since a timestamp cannot express
+who is looking. Every validator needs at most one small query, which is
+shared between the ETag and Last-Modified functions of a request.
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max, Q
+
+from .caching import get_catalog_version
+from .cart import get_cart_summary
+from .models import Category, Order, Product
+
+def _state(request, name, load):
+    """Load a view's validator state once per request"""
+    states = request.__dict__.setdefault('_conditional_state', {})
+    if name not in states:
+        states[name] = load()
+    return states[name]
+
+def viewer_state(request):
+    """What the page shows about the current visitor, or None if the page must not be revalidated"""
+    # Pending messages are shown once, so the page has to be rendered
+    if len(get_messages(request)):
+        return None
+    user = request.user.pk if request.user.is_authenticated else 'anonymous'
+    return user, get_cart_summary(request)['item_count']
+
+def is_public_view(viewer):
+    return viewer is not None and viewer == ('anonymous', 0)
+
+def make_etag(request, viewer, *parts):
+    key = '|'.join(str(part) for part in (*parts, get_catalog_version(), request.GET.urlencode(), *viewer))
+    return hashlib.md5(key.encode()).hexdigest()
+
+def latest(*timestamps):
+    return max((timestamp for timestamp in timestamps if timestamp is not None), default=None)
+
+def _product_state(request, slug):
+    return _state(request, 'product', lambda: Product.objects.filter(slug=slug, is_active=True).annotate(
+        review_count=Count('reviews'), latest_review=Max('reviews__created_at'),
+    ).values('pk', 'updated_at', 'stock', 'is_active', 'rating_sum', 'review_count', 'latest_review').first())
+
+def product_detail_etag(request, slug):
+    product, viewer = _product_state(request, slug), viewer_state(request)
+    if product is None or viewer is None:
+        return None
+    return make_etag(request, viewer, 'product', *product.values())
+
+def product_detail_last_modified(request, slug):
+    product = _product_state(request, slug)
+    if product is None or not is_public_view(viewer_state(request)):
+        return None
+    return latest(product['updated_at'], product['latest_review'])
+
+def _category_state(request, slug):
+    active = Q(products__is_active=True)
+    return _state(request, 'category', lambda: Category.objects.filter(slug=slug).annotate(
+        product_count=Count('products', filter=active), products_updated=Max('products__updated_at', filter=active),
+    ).values('pk', 'updated_at', 'product_count', 'products_updated').first())
+
+def category_detail_etag(request, slug):
+    category, viewer = _category_state(request, slug), viewer_state(request)
+    if category is None or viewer is None:
+        return None
+    return make_etag(request, viewer, 'category', *category.values())
+
+def category_detail_last_modified(request, slug):
+    category = _category_state(request, slug)
+    if category is None or not is_public_view(viewer_state(request)):
+        return None
+    return latest(category['updated_at'], category['products_updated'])
+
+def order_detail_etag(request, order_id):
+    viewer = viewer_state(request)
+    if viewer is None or not request.user.is_authenticated:
+        return None
+    updated_at = Order.objects.filter(order_id=order_id, user=request.user).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return make_etag(request, viewer, 'order', order_id, updated_at)
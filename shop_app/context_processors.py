@@ -0,0 +1,5 @@
+from .cart import get_cart_summary
+
+def cart_summary(request):
+    """Expose the cached cart summary so base.html can render the cart badge"""
+    return {'cart_summary': get_cart_summary(request)}
@@ -0,0 +1,104 @@
+"""
+Facet counts for the product_list sidebar.
+
+Every count is a conditional ``COUNT(... FILTER ...)`` in a single aggregate
+query over the searched products. Each facet applies all active filters
+except its own, so the counts show what picking another value would give.
+Results are cached per normalized filter state under a catalog-versioned key.
+"""
+import hashlib
+import json
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .caching import catalog_cache_key
+from .catalog import get_param, product_filters, search_products
+from .models import Product
+
+FACETS_TIMEOUT = 60 * 15
+
+FACET_PARAMS = ['search', 'category', 'gender', 'size', 'min_price', 'max_price']
+
+# (label, min inclusive, max exclusive)
+PRICE_BUCKETS = [
+    ('Under ₹500', None, Decimal('500')),
+    ('₹500 - ₹1000', Decimal('500'), Decimal('1000')),
+    ('₹1000 - ₹2000', Decimal('1000'), Decimal('2000')),
+    ('₹2000 & above', Decimal('2000'), None),
+]
+
+def facets_cache_key(params):
+    normalized = {name: get_param(params, name) for name in FACET_PARAMS}
+    digest = hashlib.md5(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    return catalog_cache_key(f'facets:{digest}')
+
+def _price_bucket_q(low, high):
+    q = Q()
+    if low is not None:
+        q &= Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
+def compute_facets(params, categories):
+    """Category, gender, size and price-bucket counts in one query"""
+    filters = product_filters(params)
+
+    def others(facet):
+        q = Q()
+        for name, condition in filters.items():
+            if name != facet:
+                q &= condition
+        return q
+
+    aggregates = {}
+    for category in categories:
+        aggregates[f'category_{category.pk}'] = Count('pk', filter=Q(category_id=category.pk) & others('category'))
+    for value, _ in Product.GENDERS:
+        aggregates[f'gender_{value}'] = Count('pk', filter=Q(gender=value) & others('gender'))
+    for value, _ in Product.SIZES:
+        aggregates[f'size_{value}'] = Count(
+            'pk', filter=Q(available_sizes__icontains=f'"{value}"') & others('size')
+        )
+    for index, (_, low, high) in enumerate(PRICE_BUCKETS):
+        aggregates[f'price_{index}'] = Count('pk', filter=_price_bucket_q(low, high) & others('price'))
+
+    counts = search_products(params, Product.objects.all()).order_by().aggregate(**aggregates)
+
+    return {
+        'categories': [
+            {'slug': category.slug, 'name': category.name, 'count': counts[f'category_{category.pk}']}
+            for category in categories
+        ],
+        'genders': [
+            {'value': value, 'label': label, 'count': counts[f'gender_{value}']}
+            for value, label in Product.GENDERS
+        ],
+        'sizes': [
+            {'value': value, 'label': label, 'count': counts[f'size_{value}']}
+            for value, label in Product.SIZES
+        ],
+        'price_buckets': [
+            {
+                'label': label,
+                'min': low,
+                'max': high,
+                # product_list's max_price is inclusive, bucket upper bounds are not
+                'min_param': '' if low is None else str(low),
+                'max_param': '' if high is None else str(high - Decimal('0.01')),
+                'count': counts[f'price_{index}'],
+            }
+            for index, (label, low, high) in enumerate(PRICE_BUCKETS)
+        ],
+    }
+
+def get_facets(params, categories):
+    """Cached facet counts for the current filter state"""
+    key = facets_cache_key(params)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(params, categories)
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
@@ -0,0 +1,138 @@
+"""
+Resized image derivatives for product and category images.
+
+For an original such as ``products/shirt.jpg`` the pipeline stores
+fixed-width copies next to it, in the original format and as WebP (plus
+AVIF when Pillow was built with it), e.g. ``products/shirt_320w.webp``. The
+widths and formats that were written are recorded on the model (in
+``ProductImage.derivatives`` / ``Category.image_derivatives``) so the
+``{% responsive_image %}`` tag only lists files that exist. The record also
+keeps the names the storage returned: content-addressed storage keeps
+derivative names of hashed originals but renames those of older uploads
+(``products/shirt.jpg``) after their own contents.
+
+Derivatives are generated after commit on a small background thread pool
+(see ``shop_app.signals``), and existing images are backfilled with
+``python manage.py generate_image_derivatives``, which renders on a process
+pool. This module does not import the models so pool workers stay light.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from PIL import Image, ImageOps, features
+
+DERIVATIVE_WIDTHS = (320, 640, 1024)
+
+# Pillow format name -> (extension, MIME type, save options)
+DERIVATIVE_FORMATS = {
+    'WEBP': ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'AVIF': ('avif', 'image/avif', {'quality': 60}),
+    'JPEG': ('jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'PNG': ('png', 'image/png', {'optimize': True}),
+}
+# Modern formats first, so <source> elements are listed in order of preference
+MODERN_FORMATS = ('AVIF', 'WEBP')
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-derivatives')
+
+def output_formats(source_format):
+    """Formats to render for an original: the supported modern ones plus a JPEG/PNG fallback"""
+    fallback = 'PNG' if source_format == 'PNG' else 'JPEG'
+    modern = [name for name in MODERN_FORMATS if features.check(name.lower())]
+    return modern + [fallback]
+
+def derivative_name(name, width, image_format):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}_{width}w.{DERIVATIVE_FORMATS[image_format][0]}'
+
+def render_derivatives(name, storage=None):
+    """Write the derivatives of the stored image name, returns the record saved on the model"""
+    storage = storage or default_storage
+    with storage.open(name, 'rb') as source:
+        original = Image.open(source)
+        source_format = original.format
+        original = ImageOps.exif_transpose(original)
+        original.load()
+
+    width, height = original.size
+    formats = output_formats(source_format)
+    record = {
+        'source': name, 'width': width,
+        'formats': {image_format: [] for image_format in formats},
+        'names': {image_format: [] for image_format in formats},
+    }
+    for target_width in DERIVATIVE_WIDTHS:
+        if target_width >= width:
+            break
+        resized = original.resize((target_width, round(height * target_width / width)), Image.LANCZOS)
+        for image_format in formats:
+            image = resized
+            if image_format == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            buffer = BytesIO()
+            image.save(buffer, image_format, **DERIVATIVE_FORMATS[image_format][2])
+            target = derivative_name(name, target_width, image_format)
+            if storage.exists(target):
+                storage.delete(target)
+            # Storages without save_derivative (plain FileSystemStorage) keep names anyway
+            save = getattr(storage, 'save_derivative', storage.save)
+            stored = save(target, ContentFile(buffer.getvalue()))
+            record['formats'][image_format].append(target_width)
+            record['names'][image_format].append(stored)
+    return record
+
+def stored_derivatives(record, image_format):
+    """(width, stored name) of the derivatives of one format in a record"""
+    record = record or {}
+    widths = record.get('formats', {}).get(image_format, [])
+    # Records written before the names were kept used the derived names
+    names = record.get('names', {}).get(image_format) or [
+        derivative_name(record['source'], width, image_format) for width in widths
+    ]
+    return list(zip(widths, names))
+
+def delete_derivatives(record, storage=None):
+    storage = storage or default_storage
+    for image_format in (record or {}).get('formats', {}):
+        for width, name in stored_derivatives(record, image_format):
+            # A derivative renamed after its contents may be shared with another
+            # image; cleanup_media deletes it once nothing references it
+            if name == derivative_name(record['source'], width, image_format):
+                storage.delete(name)
+
+def needs_derivatives(field_file, record):
+    return bool(field_file) and (record or {}).get('source') != field_file.name
+
+def derivative_urls(record, image_format, storage=None):
+    """(url, width) pairs of the stored derivatives of one format"""
+    storage = storage or default_storage
+    return [(storage.url(name), width) for width, name in stored_derivatives(record, image_format)]
+
+def _generate(queryset, pk, field_name, record_field, on_saved):
+    try:
+        instance = queryset.filter(pk=pk).first()
+        if instance is None:
+            return
+        field_file = getattr(instance, field_name)
+        if not needs_derivatives(field_file, getattr(instance, record_field)):
+            return
+        record = render_derivatives(field_file.name)
+        # update() so saving the record does not run the save signals again
+        queryset.filter(pk=pk).update(**{record_field: record})
+        on_saved(instance)
+    except Exception:
+        logger.exception('Could not generate derivatives for %s %s', queryset.model.__name__, pk)
+    finally:
+        # Worker threads get their own connections, which Django would never close
+        connections.close_all()
+
+def generate_in_background(queryset, pk, field_name, record_field, on_saved):
+    """Render derivatives of one image off the request thread"""
+    return _executor.submit(_generate, queryset, pk, field_name, record_field, on_saved)
@@ -0,0 +1,207 @@
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.urls import reverse
+from shop_app.catalog import PRODUCTS_PER_PAGE, SORT_ORDERINGS
+from shop_app.models import Cart, CartItem, Product, Review, UserProfile
+from shop_app.sampledata import seed_catalog
+
+CATALOG_SIZES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+BASELINE_PATH = Path(__file__).resolve().parents[2] / 'benchmark_baseline.json'
+
+# Timing changes smaller than this are noise, whatever the ratio; query
+# counts are the strict signal
+MIN_TIME_DELTA_MS = 10.0
+
+# Iterations of the pure-Python loop timed next to every request. Baseline
+# timings are scaled by how long it took then and now, so a slower or busier
+# machine does not read as a regression.
+CALIBRATION_LOOPS = 100_000
+
+CHECKOUT_DATA = {
+    'shipping_address': '1 Benchmark Road',
+    'shipping_city': 'Pune',
+    'shipping_state': 'Maharashtra',
+    'shipping_zip': '411001',
+    'shipping_country': 'India',
+    'phone': '9999999999',
+    'payment_method': 'COD',
+}
+
+def calibration_ms():
+    started = time.perf_counter()
+    total = 0
+    for number in range(CALIBRATION_LOOPS):
+        total += number * number
+    return (time.perf_counter() - started) * 1000
+
+def scenarios(product_count, detail_slug, category_slug):
+    """(name, path, cart lines or None for an anonymous visitor, POST data) for every benchmarked request"""
+    listing = reverse('shop:product_list')
+    pages = max(product_count // PRODUCTS_PER_PAGE, 1)
+    yield 'home', reverse('shop:home'), None, None
+    yield 'product_list', listing, None, None
+    yield 'product_list: search', f'{listing}?search=cotton+shirt', None, None
+    yield 'product_list: category', f'{listing}?category={category_slug}', None, None
+    yield 'product_list: gender', f'{listing}?gender=F', None, None
+    yield 'product_list: price range', f'{listing}?min_price=500&max_price=1500', None, None
+    for sort in SORT_ORDERINGS:
+        yield f'product_list: sort={sort}', f'{listing}?sort={sort}', None, None
+    yield 'product_list: middle page', f'{listing}?page={pages // 2 or 1}', None, None
+    yield 'product_list: last page', f'{listing}?page={pages}', None, None
+    yield 'product_detail', reverse('shop:product_detail', args=[detail_slug]), None, None
+    for lines in [1, 10, 50]:
+        yield f'cart_view: {lines} items', reverse('shop:cart'), lines, None
+    yield 'checkout', reverse('shop:checkout'), 10, None
+    yield 'checkout: place order', reverse('shop:checkout'), 10, CHECKOUT_DATA
+
+class Command(BaseCommand):
+    help = (
+        'Time the shop pages against a seeded catalog and compare query counts and wall time '
+        'with the stored baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=list(CATALOG_SIZES), default='1k', help='Catalog size to seed')
+        parser.add_argument(
+            '--repeat', type=int, default=11, help='Timed runs per request after one warm-up, the median is kept',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.25,
+            help='Fail when a request gets slower than the baseline by more than this fraction',
+        )
+        parser.add_argument('--baseline', default=str(BASELINE_PATH), help='Baseline JSON file')
+        parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline')
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the seeded benchmark database for the next run (seeding 1m products takes a while)',
+        )
+
+    def handle(self, *args, **options):
+        size = options['size']
+        if connection.vendor == 'sqlite':
+            # A file, not the in-memory test database, so timings include real I/O and --keepdb works
+            # (in the temp directory, so it never lands in the source tree)
+            database = Path(tempfile.gettempdir()) / f'shop_benchmark_{size}.sqlite3'
+            connection.settings_dict['TEST']['NAME'] = str(database)
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = self.run_benchmarks(CATALOG_SIZES[size], options['repeat'])
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        baseline_path = Path(options['baseline'])
+        baselines = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+        regressions = self.report(results, baselines.get(size, {}), options['threshold'])
+
+        if options['update_baseline']:
+            baselines[size] = results
+            baseline_path.write_text(json.dumps(baselines, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline for {size} written to {baseline_path}'))
+        elif regressions:
+            raise CommandError(f'{len(regressions)} requests regressed: {", ".join(regressions)}')
+
+    def seed(self, product_count):
+        existing = Product.objects.count()
+        if existing and existing != product_count:
+            raise CommandError(f'The kept benchmark database has {existing} products, run without --keepdb')
+        if not existing:
+            self.stdout.write(f'Seeding {product_count} products...')
+            started = time.monotonic()
+            seed_catalog(product_count)
+            self.stdout.write(f'Seeded in {time.monotonic() - started:.1f}s')
+
+        user, created = User.objects.get_or_create(username='benchmark')
+        if created:
+            UserProfile.objects.create(user=user, address='1 Benchmark Road', city='Pune')
+            # Reviews go through the signal handlers that maintain the rating aggregates
+            product = Product.objects.filter(is_active=True).order_by('id')[product_count // 2]
+            for number in range(10):
+                reviewer = User.objects.create(username=f'reviewer{number}')
+                Review.objects.create(product=product, user=reviewer, rating=number % 5 + 1, comment='Fits well.')
+        return user
+
+    def run_benchmarks(self, product_count, repeat):
+        user = self.seed(product_count)
+        detail = Product.objects.filter(is_active=True, reviews__isnull=False).select_related('category').first()
+        cart_products = list(Product.objects.filter(is_active=True, stock__gte=10).order_by('id')[:50])
+
+        anonymous, customer = Client(), Client()
+        customer.force_login(user)
+
+        results = {}
+        for name, path, cart_lines, data in scenarios(product_count, detail.slug, detail.category.slug):
+            client = anonymous if cart_lines is None else customer
+            # The first run warms up imports, templates and the database page cache and is not timed
+            runs = [
+                self.run_once(name, client, path, data, user, cart_products[:cart_lines or 0])
+                for run in range(repeat + 1)
+            ][1:]
+            results[name] = {
+                'queries': runs[-1][0],
+                'ms': round(statistics.median(ms for queries, ms, calibration in runs), 2),
+                'calibration_ms': round(statistics.median(calibration for queries, ms, calibration in runs), 2),
+            }
+        return results
+
+    def run_once(self, name, client, path, data, user, cart_products):
+        """Request a page once, returns (queries, milliseconds, calibration milliseconds)"""
+        calibration = calibration_ms()
+        # Measure cold caches, so the query counts do not depend on earlier runs
+        for cache in caches.all():
+            cache.clear()
+        # Every run starts from the same data: the cart is filled and the order rolled back
+        with transaction.atomic():
+            if cart_products:
+                cart, created = Cart.objects.get_or_create(user=user)
+                CartItem.objects.bulk_create([
+                    CartItem(cart=cart, product=product, size='M', quantity=1) for product in cart_products
+                ])
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.post(path, data) if data else client.get(path)
+                elapsed = (time.perf_counter() - started) * 1000
+            transaction.set_rollback(True)
+        expected = 302 if data else 200
+        if response.status_code != expected or (data and response.url == reverse('shop:cart')):
+            raise CommandError(f'{name}: {path} answered {response.status_code}')
+        return len(queries), elapsed, calibration
+
+    def report(self, results, baseline, threshold):
+        """Print every request against its baseline, returns the names of the regressed ones"""
+        regressions = []
+        for name, result in results.items():
+            line = f'{name:<32} {result["queries"]:>4} queries {result["ms"]:>9.2f} ms'
+            previous = baseline.get(name)
+            if previous is None:
+                self.stdout.write(f'{line}   (no baseline)')
+                continue
+
+            expected = previous['ms']
+            if result.get('calibration_ms') and previous.get('calibration_ms'):
+                expected *= result['calibration_ms'] / previous['calibration_ms']
+            line += f'   baseline {previous["queries"]:>4} queries {expected:>9.2f} ms (scaled)'
+            slower = result['ms'] - expected
+            if result['queries'] > previous['queries'] or (
+                slower > MIN_TIME_DELTA_MS and slower > expected * threshold
+            ):
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(f'{line}   REGRESSED'))
+            else:
+                self.stdout.write(self.style.SUCCESS(line))
+        return regressions
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from shop_app.models import ProductRecommendation
+from shop_app.recommendations import (
+    DEFAULT_TOP_K, build_co_purchase_recommendations, build_similar_recommendations,
+)
+
+BUILDERS = {
+    ProductRecommendation.CO_PURCHASE: build_co_purchase_recommendations,
+    ProductRecommendation.SIMILAR: build_similar_recommendations,
+}
+
+class Command(BaseCommand):
+    help = 'Rebuild "customers also bought" and "similar products" recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K, help='Neighbours stored per product')
+        parser.add_argument(
+            '--kind', choices=list(BUILDERS), action='append',
+            help='Only rebuild this kind of recommendation (repeatable, default all)',
+        )
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or BUILDERS:
+            self.stdout.write(f'Building {kind} recommendations...')
+            started = time.monotonic()
+            count = BUILDERS[kind](top_k=options['top_k'])
+            self.stdout.write(
+                self.style.SUCCESS(f'Stored {count} recommendations in {time.monotonic() - started:.1f}s.')
+            )
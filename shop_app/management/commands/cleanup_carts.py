@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from shop_app.cleanup import (
+    DEFAULT_BATCH_SIZE, abandoned_carts, delete_expired_sessions, delete_in_pk_batches, free_space_bytes,
+)
+
+class Command(BaseCommand):
+    help = 'Delete abandoned anonymous carts and expired sessions in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.SHOP_ABANDONED_CART_DAYS,
+            help='Delete anonymous carts idle for this many days',
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Primary keys per batch')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+        parser.add_argument('--skip-sessions', action='store_true', help='Leave expired sessions alone')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running, cleaning up every this many seconds (for a scheduler-less deployment)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.cleanup(options)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def cleanup(self, options):
+        free_before = free_space_bytes()
+
+        results = [delete_in_pk_batches(
+            abandoned_carts(options['days']), options['batch_size'], options['pause'],
+        )]
+        if not options['skip_sessions']:
+            results.append(delete_expired_sessions(options['batch_size'], options['pause']))
+
+        for result in results:
+            self.stdout.write(
+                f'{result.name}: deleted {result.rows} rows in {result.batches} batches, '
+                f'{result.seconds:.1f}s ({result.rows_per_second:.0f} rows/s)'
+            )
+
+        free_after = free_space_bytes()
+        if free_before is not None and free_after is not None:
+            self.stdout.write(
+                self.style.SUCCESS(f'Space reclaimed: {filesizeformat(max(free_after - free_before, 0))}')
+            )
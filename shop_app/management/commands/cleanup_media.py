@@ -0,0 +1,34 @@
+import time
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from shop_app.cleanup import DEFAULT_BATCH_SIZE, unreferenced_media
+
+class Command(BaseCommand):
+    help = 'Delete product and category media files that no image or derivative references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=24, help='Only delete files older than this many hours')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Files per progress line')
+        parser.add_argument('--dry-run', action='store_true', help='List the files instead of deleting them')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        deleted = reclaimed = 0
+        for name, size in unreferenced_media(timedelta(hours=options['min_age'])):
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                default_storage.delete(name)
+            deleted += 1
+            reclaimed += size
+            if deleted % options['batch_size'] == 0:
+                self.stdout.write(f'{deleted} files, {filesizeformat(reclaimed)} so far...')
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {deleted} unreferenced files ({filesizeformat(reclaimed)}) '
+            f'in {time.monotonic() - started:.1f}s.'
+        ))
@@ -0,0 +1,67 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from shop_app.catalog import SORT_ORDERINGS, filter_products, sort_products
+from shop_app.models import Cart, CartItem, Order, Product, ProductImage
+
+# Plan lines that mean a whole table is read, per database vendor
+FULL_SCAN_PATTERNS = {
+    # A bare "SCAN shop_app_product", not "SCAN ... USING INDEX" or an FTS "VIRTUAL TABLE" scan
+    'sqlite': re.compile(r'\bSCAN (\w+)\s*$', re.MULTILINE),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+TEMP_SORT_PATTERNS = {
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY'),
+    'postgresql': re.compile(r'Sort Key'),
+}
+
+def view_queries():
+    """The queries the shop views run, with placeholder parameters"""
+    yield 'home: featured', Product.objects.for_listing().filter(is_featured=True, is_active=True)[:8]
+    yield 'home: latest', Product.objects.for_listing().filter(is_active=True).order_by('-created_at')[:8]
+    for sort in SORT_ORDERINGS:
+        yield f'product_list: sort={sort}', filter_products({'sort': sort})[0][:12]
+    yield 'product_list: category', filter_products({'category': 'mens-clothing'})[0][:12]
+    yield 'product_list: gender', filter_products({'gender': 'F'})[0][:12]
+    yield 'product_list: price range', filter_products({'min_price': '500', 'max_price': '1500', 'sort': 'price_low'})[0][:12]
+    yield 'product_list: search', filter_products({'search': 'shirt'})[0][:12]
+    yield 'category_detail', sort_products(Product.objects.for_listing().filter(category_id=1, is_active=True), 'newest')[:12]
+    # get_object_or_404() drops the default ordering
+    yield 'product_detail', Product.objects.select_related('category').filter(slug='classic-white-tshirt', is_active=True).order_by()
+    yield 'product images', ProductImage.objects.filter(product_id=1).order_by('-is_primary', 'id')[:1]
+    yield 'cart: anonymous', Cart.objects.filter(session_key='x' * 32, user=None)
+    yield 'cart: user', Cart.objects.filter(user_id=1)
+    yield 'cart: line lookup', CartItem.objects.filter(cart_id=1, product_id=1, size='M')
+    yield 'order_history', Order.objects.filter(user_id=1).order_by('-created_at')
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the queries behind each shop view and flag full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show-plans', action='store_true', help='Print every query plan')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit with an error if any full scan is found')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        scan_pattern = FULL_SCAN_PATTERNS.get(vendor)
+        sort_pattern = TEMP_SORT_PATTERNS.get(vendor)
+        if scan_pattern is None:
+            raise CommandError(f'Full scan detection is not supported for {vendor}')
+
+        flagged = []
+        for name, queryset in view_queries():
+            plan = queryset.explain()
+            scanned = sorted(set(scan_pattern.findall(plan)))
+            if scanned:
+                flagged.append(name)
+                self.stdout.write(self.style.ERROR(f'FULL SCAN  {name}: {", ".join(scanned)}'))
+            elif sort_pattern.search(plan):
+                self.stdout.write(self.style.WARNING(f'SORT       {name}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'OK         {name}'))
+            if options['show_plans']:
+                self.stdout.write(plan)
+
+        if flagged and options['fail_on_scan']:
+            raise CommandError(f'{len(flagged)} queries use full table scans')
@@ -0,0 +1,68 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from shop_app.caching import bump_catalog_version
+from shop_app.images import render_derivatives
+from shop_app.models import Category, Product, ProductImage
+
+# (model, image field, derivatives record field)
+IMAGE_FIELDS = [
+    (ProductImage, 'image', 'derivatives'),
+    (Category, 'image', 'image_derivatives'),
+]
+SAVE_BATCH_SIZE = 500
+
+class Command(BaseCommand):
+    help = 'Generate resized and WebP/AVIF derivatives for existing product and category images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+        parser.add_argument('--force', action='store_true', help='Regenerate images that already have derivatives')
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model, field_name, record_field in IMAGE_FIELDS:
+            images = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            for pk, name, record in images.values_list('pk', field_name, record_field).iterator():
+                if options['force'] or (record or {}).get('source') != name:
+                    jobs.append((model, record_field, pk, name))
+        self.stdout.write(f'Generating derivatives for {len(jobs)} images with {options["workers"]} workers...')
+        if not jobs:
+            return
+
+        started = time.monotonic()
+        pending = {model: [] for model, field_name, record_field in IMAGE_FIELDS}
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            futures = {pool.submit(render_derivatives, name): (model, record_field, pk, name)
+                       for model, record_field, pk, name in jobs}
+            for future in as_completed(futures):
+                model, record_field, pk, name = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{name}: {e}')
+                    continue
+                pending[model].append(model(pk=pk, **{record_field: record}))
+                if len(pending[model]) >= SAVE_BATCH_SIZE:
+                    self.save(model, record_field, pending[model])
+                    pending[model] = []
+        for model, field_name, record_field in IMAGE_FIELDS:
+            self.save(model, record_field, pending[model])
+
+        # Cached product cards are keyed on updated_at
+        Product.objects.filter(images__isnull=False).update(updated_at=timezone.now())
+        bump_catalog_version()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {len(jobs) - failed} images in {elapsed:.1f}s ({failed} failed).'
+        ))
+
+    def save(self, model, record_field, objects):
+        model.objects.bulk_update(objects, [record_field], batch_size=SAVE_BATCH_SIZE)
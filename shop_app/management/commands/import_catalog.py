@@ -0,0 +1,69 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from shop_app.catalog_import import DEFAULT_CHUNK_SIZE, FORMATS, detect_format, import_products
+
+class Command(BaseCommand):
+    help = 'Create or update products by slug from CSV or JSON Lines files (optionally gzipped)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files to import, in order')
+        parser.add_argument('--format', choices=FORMATS, help='File format, by default taken from the file name')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Products per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and count without writing anything')
+        parser.add_argument('--errors', help='Write the rejected rows to this JSON Lines file')
+        parser.add_argument('--show-errors', type=int, default=20, help='Rejected rows to print')
+
+    def handle(self, *args, **options):
+        if not options['format']:
+            try:
+                for path in options['paths']:
+                    detect_format(path)
+            except ValueError as e:
+                raise CommandError(e)
+
+        errors_file = open(options['errors'], 'w') if options['errors'] else None
+        shown = 0
+        last_progress = time.monotonic()
+
+        def on_error(path, line_number, row, message):
+            nonlocal shown
+            if shown < options['show_errors']:
+                self.stderr.write(f'{path}:{line_number}: {message}')
+                shown += 1
+            if errors_file:
+                errors_file.write(json.dumps({
+                    'path': path, 'line': line_number, 'error': message,
+                    'row': row if isinstance(row, dict) else None,
+                }) + '\n')
+
+        def on_progress(result):
+            nonlocal last_progress
+            if time.monotonic() - last_progress < 1:
+                return
+            last_progress = time.monotonic()
+            self.stdout.write(
+                f'{result.rows} rows, {result.created} created, {result.updated} updated, '
+                f'{result.errors} errors, {result.rows_per_second:.0f} rows/s'
+            )
+
+        try:
+            result = import_products(
+                options['paths'], options['format'], options['chunk_size'], options['dry_run'],
+                on_error=on_error, on_progress=on_progress,
+            )
+        except OSError as e:
+            raise CommandError(e)
+        finally:
+            if errors_file:
+                errors_file.close()
+
+        if result.errors > shown:
+            self.stderr.write(f'... {result.errors - shown} more rejected rows')
+        action = 'Would create' if options['dry_run'] else 'Created'
+        summary = (
+            f'{action} {result.created} and updated {result.updated} products from {result.rows} rows '
+            f'in {result.seconds:.1f}s ({result.rows_per_second:.0f} rows/s), {result.errors} rejected.'
+        )
+        self.stdout.write(self.style.WARNING(summary) if result.errors else self.style.SUCCESS(summary))
@@ -1,12 +1,34 @@
+import time
+
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from shop_app.models import Category, Product, ProductImage
+from shop_app.sampledata import (
+    DEFAULT_BATCH_SIZE, SAMPLE_PASSWORD, seed_catalog, seed_orders, seed_reviews, seed_users,
+)
 from decimal import Decimal
 
 class Command(BaseCommand):
-    help = 'Populate database with sample categories and products'
+    help = (
+        'Populate database with sample categories and products, or with a synthetic catalog, '
+        'users, reviews and orders of any size for capacity testing'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=0, help='Synthetic products to generate')
+        parser.add_argument('--users', type=int, default=0, help='Synthetic customers to generate')
+        parser.add_argument(
+            '--reviews', type=int, default=0, help='About this many reviews, spread over all products',
+        )
+        parser.add_argument('--orders', type=int, default=0, help='Orders to generate for the existing users')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per transaction')
 
     def handle(self, *args, **options):
+        if any(options[name] for name in ['products', 'users', 'reviews', 'orders']):
+            self.generate(options)
+            return
+
         self.stdout.write('Creating sample data...')
 
         # Create categories
@@ -149,4 +171,29 @@ class Command(BaseCommand):
 
         self.stdout.write(
             self.style.SUCCESS('Successfully created sample data!')
-        ) 
\ No newline at end of file
+        ) 
+
+    def generate(self, options):
+        """Bulk-load the synthetic data, users first so reviews and orders can refer to them"""
+        seed, batch_size = options['seed'], options['batch_size']
+        started = time.monotonic()
+        steps = [
+            ('users', seed_users), ('products', seed_catalog), ('reviews', seed_reviews), ('orders', seed_orders),
+        ]
+        for name, seed_function in steps:
+            if not options[name]:
+                continue
+            step_started = time.monotonic()
+            self.stdout.write(f'Generating {name}...')
+            seed_function(options[name], seed=seed, batch_size=batch_size, progress=self.progress)
+            self.stdout.write(f'  done in {time.monotonic() - step_started:.1f}s')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated sample data in {time.monotonic() - started:.1f}s: '
+            f'{Product.objects.count()} products, {User.objects.count()} users.'
+        ))
+        if options['users']:
+            self.stdout.write(f'Generated users log in as shopper<N> with the password "{SAMPLE_PASSWORD}".')
+
+    def progress(self, name, done, total):
+        self.stdout.write(f'  {name}: {done}/{total}')
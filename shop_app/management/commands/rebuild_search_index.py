@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shop_app.search import get_search_backend
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        self.stdout.write(f'Rebuilding search index with {backend.__class__.__name__}...')
+
+        with transaction.atomic():
+            backend.setup()
+            count = backend.rebuild()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {count} products.')
+        )
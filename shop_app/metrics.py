@@ -0,0 +1,100 @@
+"""
+Database write metrics.
+
+``DatabaseWriteMetricsMiddleware`` counts the INSERT, UPDATE and DELETE
+statements run while handling each request, including the session save done
+by ``SessionMiddleware`` on the way out, so it must be listed before it. The
+count is logged to the ``shop_app.metrics`` logger, and anonymous GET page
+views of HTML pages are accumulated in the cache so ``db_write_metrics()`` can report the
+average number of writes per anonymous page view.
+
+The middleware is sync and async capable, so it does not force async views
+(the cart endpoints) onto a thread under ASGI.
+"""
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.cache import cache
+
+from .query_observers import aobserve_queries, observe_queries
+
+logger = logging.getLogger('shop_app.metrics')
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+ANONYMOUS_VIEWS_KEY = 'metrics:anonymous_page_views'
+ANONYMOUS_WRITES_KEY = 'metrics:anonymous_db_writes'
+
+def is_write(sql):
+    return sql.lstrip().upper().startswith(WRITE_STATEMENTS)
+
+def _incr(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+def record_anonymous_page_view(writes):
+    _incr(ANONYMOUS_VIEWS_KEY, 1)
+    if writes:
+        _incr(ANONYMOUS_WRITES_KEY, writes)
+
+def db_write_metrics():
+    """Anonymous page views, the DB writes they caused and the average per view"""
+    views = cache.get(ANONYMOUS_VIEWS_KEY, 0)
+    writes = cache.get(ANONYMOUS_WRITES_KEY, 0)
+    return {
+        'anonymous_page_views': views,
+        'anonymous_db_writes': writes,
+        'writes_per_anonymous_view': writes / views if views else 0.0,
+    }
+
+def reset_db_write_metrics():
+    cache.delete_many([ANONYMOUS_VIEWS_KEY, ANONYMOUS_WRITES_KEY])
+
+class WriteCounter:
+    """Query observer counting write statements"""
+
+    def __init__(self):
+        self.writes = 0
+
+    def __call__(self, sql, seconds):
+        if is_write(sql):
+            self.writes += 1
+
+class DatabaseWriteMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = WriteCounter()
+        with observe_queries(counter):
+            response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        self.record(request, response, counter.writes, user is None or not user.is_authenticated)
+        return response
+
+    async def __acall__(self, request):
+        counter = WriteCounter()
+        async with aobserve_queries(counter):
+            response = await self.get_response(request)
+        user = await request.auser() if hasattr(request, 'auser') else None
+        await sync_to_async(self.record)(request, response, counter.writes, user is None or not user.is_authenticated)
+        return response
+
+    def record(self, request, response, writes, anonymous):
+        request.db_writes = writes
+        if anonymous and request.method == 'GET' and response.get('Content-Type', '').startswith('text/html'):
+            record_anonymous_page_view(writes)
+        logger.debug(
+            '%s %s: %d DB writes (%s)', request.method, request.path, writes,
+            'anonymous' if anonymous else 'authenticated',
+        )
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from shop_app.search import get_search_backend
+
+    backend = get_search_backend(schema_editor.connection)
+    backend.setup()
+    backend.rebuild()
+
+
+def drop_search_index(apps, schema_editor):
+    from shop_app.search import get_search_backend
+
+    get_search_backend(schema_editor.connection).teardown()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 02:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0004_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('co_purchase', 'Customers also bought')], max_length=20)),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='shop_app.product')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_in', to='shop_app.product')),
+            ],
+            options={
+                'ordering': ['product', 'kind', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('product', 'kind', 'rank'), name='unique_recommendation_rank')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0005_product_recommendation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productrecommendation',
+            name='kind',
+            field=models.CharField(choices=[('co_purchase', 'Customers also bought'), ('similar', 'Similar products')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 02:23
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    CartItem = apps.get_model("shop_app", "CartItem")
+    duplicates = (
+        CartItem.objects.values("cart_id", "product_id", "size")
+        .annotate(lines=Count("id"), keep_id=Min("id"), total=Sum("quantity"))
+        .filter(lines__gt=1)
+    )
+    for line in duplicates:
+        same = CartItem.objects.filter(cart_id=line["cart_id"], product_id=line["product_id"], size=line["size"])
+        same.exclude(id=line["keep_id"]).delete()
+        same.filter(id=line["keep_id"]).update(quantity=line["total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0006_recommendation_similar_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='cartitem',
+            name='cartitem_line_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product', 'size'), name='unique_cart_line'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Coalesce
 import uuid
 
 class Category(models.Model):
@@ -8,6 +9,8 @@ class Category(models.Model):
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    # Resized copies of image written by shop_app.images
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -18,6 +21,29 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+def primary_image_prefetch(lookup='images'):
+    """Prefetch only the first (primary) image of each product into listing_images"""
+    return models.Prefetch(
+        lookup,
+        queryset=ProductImage.objects.order_by('-is_primary', 'id')[:1],
+        to_attr='listing_images',
+    )
+
+class ProductQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(is_active=True)
+
+    def for_listing(self):
+        """Products ready to render as grid cards without per-card queries"""
+        image_count = ProductImage.objects.filter(product=models.OuterRef('pk')).values('product').annotate(
+            count=models.Count('pk')
+        ).values('count')
+        return self.select_related('category').prefetch_related(
+            primary_image_prefetch()
+        ).annotate(
+            image_count=Coalesce(models.Subquery(image_count), 0)
+        )
+
 class Product(models.Model):
     SIZES = [
         ('XS', 'Extra Small'),
@@ -45,15 +71,54 @@ class Product(models.Model):
     gender = models.CharField(max_length=1, choices=GENDERS, default='U')
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
+    # Review aggregates, maintained by shop_app.reviews from Review signals
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_average = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        # Listing pages only ever show active products, so the sort indexes are
+        # partial on is_active and end in id like the listing orderings.
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_active=True), name='product_active_newest_idx'),
+            models.Index(fields=['price', 'id'], condition=models.Q(is_active=True), name='product_active_price_idx'),
+            models.Index(fields=['name', 'id'], condition=models.Q(is_active=True), name='product_active_name_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], condition=models.Q(is_active=True), name='product_active_cat_idx'),
+            models.Index(fields=['gender', '-created_at', '-id'], condition=models.Q(is_active=True), name='product_active_gender_idx'),
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True, is_featured=True), name='product_featured_idx'),
+            models.Index(fields=['-rating_average', '-id'], condition=models.Q(is_active=True), name='product_active_rating_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def primary_image(self):
+        # Use the image prefetched by ProductQuerySet.for_listing() when available
+        if hasattr(self, 'listing_images'):
+            return self.listing_images[0] if self.listing_images else None
+        return self.images.order_by('-is_primary', 'id').first()
+
+    @property
+    def rating_histogram(self):
+        """(stars, count, percent) from 5 stars down to 1"""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}_count')
+            percent = round(100 * count / self.rating_count) if self.rating_count else 0
+            histogram.append((stars, count, percent))
+        return histogram
+
     @property
     def is_on_sale(self):
         return self.sale_price is not None and self.sale_price < self.price
@@ -65,10 +130,18 @@ class Product(models.Model):
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/')
+    # Resized copies of image written by shop_app.images
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
     alt_text = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Matches primary_image_prefetch(): first image per product
+            models.Index(fields=['product', '-is_primary', 'id'], name='productimage_primary_idx'),
+        ]
+
     def __str__(self):
         return f"{self.product.name} - {self.alt_text}"
 
@@ -92,6 +165,11 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['session_key'], condition=models.Q(user__isnull=True), name='cart_anon_session_idx'),
+        ]
+
     def __str__(self):
         return f"Cart {self.id} - {self.user.username if self.user else 'Anonymous'}"
 
@@ -102,6 +180,12 @@ class CartItem(models.Model):
     size = models.CharField(max_length=10, blank=True)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # One line per product and size; also the conflict target for merging carts at login
+            models.UniqueConstraint(fields=['cart', 'product', 'size'], name='unique_cart_line'),
+        ]
+
     def __str__(self):
         return f"{self.quantity}x {self.product.name} in {self.cart}"
 
@@ -136,6 +220,9 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.order_id} - {self.user.username}"
@@ -150,6 +237,10 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.quantity}x {self.product.name} in Order {self.order.order_id}"
 
+    @property
+    def total_price(self):
+        return self.quantity * self.price
+
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -163,3 +254,27 @@ class Review(models.Model):
 
     def __str__(self):
         return f"{self.user.username}'s review on {self.product.name}"
+
+class ProductRecommendation(models.Model):
+    """Precomputed top-K neighbours of a product, see shop_app.recommendations"""
+    CO_PURCHASE = 'co_purchase'
+    SIMILAR = 'similar'
+    KINDS = [
+        (CO_PURCHASE, 'Customers also bought'),
+        (SIMILAR, 'Similar products'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_in')
+    kind = models.CharField(max_length=20, choices=KINDS)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'kind', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'kind', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} -> {self.recommended.name} ({self.kind} #{self.rank})"
@@ -0,0 +1,81 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, When
+
+from .pricing import calculate_shipping
+from .models import Order, OrderItem, Product
+
+SHIPPING_FIELDS = [
+    'shipping_address',
+    'shipping_city',
+    'shipping_state',
+    'shipping_zip',
+    'shipping_country',
+    'phone',
+    'payment_method',
+    'notes',
+]
+
+class OrderError(Exception):
+    """Raised when a cart cannot be turned into an order"""
+
+def place_order(user, cart, shipping_data):
+    """Turn a cart into an order, reserving stock.
+
+    Everything runs in one transaction with the cart's product rows locked,
+    so concurrent checkouts cannot oversell. The number of queries does not
+    depend on the number of cart lines.
+    """
+    with transaction.atomic():
+        cart_items = list(cart.items.all())
+        if not cart_items:
+            raise OrderError('Your cart is empty!')
+
+        quantities = defaultdict(int)
+        for item in cart_items:
+            quantities[item.product_id] += item.quantity
+
+        products = Product.objects.select_for_update().only(
+            'id', 'name', 'price', 'sale_price', 'stock', 'is_active'
+        ).in_bulk(list(quantities))
+
+        unavailable = []
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None or not product.is_active:
+                unavailable.append(f'{product.name if product else "A product"} is no longer available')
+            elif product.stock < quantity:
+                unavailable.append(f'Only {product.stock} of {product.name} left in stock')
+        if unavailable:
+            raise OrderError('; '.join(unavailable))
+
+        subtotal = sum(products[item.product_id].current_price * item.quantity for item in cart_items)
+        order = Order.objects.create(
+            user=user,
+            total_amount=subtotal + calculate_shipping(subtotal),
+            **{field: shipping_data[field] for field in SHIPPING_FIELDS if field in shipping_data},
+        )
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                price=products[item.product_id].current_price,
+                size=item.size,
+            )
+            for item in cart_items
+        ])
+
+        Product.objects.filter(id__in=list(quantities)).update(
+            stock=Case(
+                *[When(id=product_id, then=F('stock') - quantity) for product_id, quantity in quantities.items()],
+                default=F('stock'),
+                output_field=PositiveIntegerField(),
+            ),
+        )
+
+        cart.delete()
+
+    return order
@@ -0,0 +1,91 @@
+"""
+Keyset (cursor) pagination for product listings.
+
+Instead of ``COUNT(*)`` plus ``OFFSET``, each page continues after the sort
+key of the last product on the previous page, e.g. for the newest-first sort
+
+    WHERE created_at < :created_at OR (created_at = :created_at AND id < :id)
+
+so fetching page 500 costs the same as fetching page 1. The cursor is an
+opaque URL-safe token holding that last sort key.
+"""
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+
+# Sort option -> (field, descending); ties are broken on id in the same direction
+KEYSET_SORTS = {
+    'newest': ('created_at', True),
+    'price_low': ('price', False),
+    'price_high': ('price', True),
+    'name': ('name', False),
+    'top_rated': ('rating_average', True),
+}
+
+FIELD_PARSERS = {
+    'created_at': datetime.fromisoformat,
+    'price': Decimal,
+    'name': str,
+    'rating_average': Decimal,
+}
+
+class InvalidCursor(ValueError):
+    pass
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+def keyset_sort(sort_by):
+    """Keyset sorts follow the listing sort; relevance has no stable key and falls back to newest"""
+    return sort_by if sort_by in KEYSET_SORTS else 'newest'
+
+def encode_cursor(product, sort_by):
+    field, _ = KEYSET_SORTS[sort_by]
+    value = getattr(product, field)
+    value = value.isoformat() if isinstance(value, datetime) else str(value)
+    payload = json.dumps([value, product.pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_by):
+    field, _ = KEYSET_SORTS[sort_by]
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return FIELD_PARSERS[field](value), int(pk)
+    except (ValueError, TypeError, InvalidOperation):
+        raise InvalidCursor('Invalid cursor')
+
+def paginate_by_cursor(products, sort_by, cursor=None, per_page=12):
+    """Return the page of products after cursor, ordered by the keyset for sort_by"""
+    sort_by = keyset_sort(sort_by)
+    field, descending = KEYSET_SORTS[sort_by]
+    prefix = '-' if descending else ''
+    products = products.order_by(f'{prefix}{field}', f'{prefix}id')
+
+    if cursor:
+        value, pk = decode_cursor(cursor, sort_by)
+        op = 'lt' if descending else 'gt'
+        products = products.filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk})
+        )
+
+    # One extra row tells us whether there is a next page, without a COUNT
+    rows = list(products[:per_page + 1])
+    object_list = rows[:per_page]
+    next_cursor = encode_cursor(object_list[-1], sort_by) if len(rows) > per_page else None
+    return CursorPage(object_list, next_cursor)
@@ -0,0 +1,86 @@
+"""
+Cart pricing computed in the database.
+
+Line totals are annotated onto cart items with the same sale-price rule as
+``Product.current_price``, and the cart totals come from one aggregate
+query, so pricing a cart costs a single round-trip regardless of its size.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import CartItem
+
+FREE_SHIPPING_THRESHOLD = Decimal('1000')
+SHIPPING_FEE = Decimal('100')
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+CENTS = Decimal('0.01')
+
+def calculate_shipping(subtotal):
+    """Free shipping over ₹1000"""
+    return Decimal('0') if subtotal > FREE_SHIPPING_THRESHOLD else SHIPPING_FEE
+
+def current_price_expression(prefix=''):
+    """SQL equivalent of Product.current_price, prefix is the lookup path to the product"""
+    return Case(
+        When(
+            Q(**{f'{prefix}sale_price__isnull': False}) & Q(**{f'{prefix}sale_price__lt': F(f'{prefix}price')}),
+            then=F(f'{prefix}sale_price'),
+        ),
+        default=F(f'{prefix}price'),
+        output_field=MONEY,
+    )
+
+def line_total_expression():
+    return ExpressionWrapper(F('quantity') * current_price_expression('product__'), output_field=MONEY)
+
+def priced_cart_items(cart):
+    """Cart items annotated with unit_price and line_total"""
+    # An unsaved cart from get_cart() has no items and needs no query
+    items = CartItem.objects.none() if cart.pk is None else cart.items
+    return items.annotate(
+        unit_price=current_price_expression('product__'),
+        line_total=line_total_expression(),
+    )
+
+def priced_products(products):
+    """Products annotated with unit_price, for carts whose lines are not CartItem rows"""
+    return products.annotate(unit_price=current_price_expression())
+
+def _totals_aggregates():
+    return {
+        'item_count': Count('id'),
+        'total_quantity': Coalesce(Sum('quantity'), 0),
+        'subtotal': Coalesce(Sum(line_total_expression()), Value(Decimal('0.00')), output_field=MONEY),
+    }
+
+def _with_shipping(totals):
+    # SQLite returns computed decimals unquantized
+    totals['subtotal'] = totals['subtotal'].quantize(CENTS)
+    totals['shipping'] = calculate_shipping(totals['subtotal'])
+    totals['total'] = totals['subtotal'] + totals['shipping']
+    return totals
+
+EMPTY_TOTALS = {'item_count': 0, 'total_quantity': 0, 'subtotal': Decimal('0.00')}
+
+def cart_totals(cart):
+    """Item count, quantity total, subtotal, shipping and total for a cart in one query"""
+    if cart is None or cart.pk is None:
+        return _with_shipping(dict(EMPTY_TOTALS))
+    return _with_shipping(cart.items.aggregate(**_totals_aggregates()))
+
+def line_totals(lines):
+    """cart_totals() of lines already fetched with their line_total, such as cookie cart lines"""
+    return _with_shipping({
+        'item_count': len(lines),
+        'total_quantity': sum(line.quantity for line in lines),
+        'subtotal': sum((line.line_total for line in lines), EMPTY_TOTALS['subtotal']),
+    })
+
+async def acart_totals(cart):
+    """Async cart_totals()"""
+    if cart is None or cart.pk is None:
+        return _with_shipping(dict(EMPTY_TOTALS))
+    return _with_shipping(await cart.items.aaggregate(**_totals_aggregates()))
@@ -0,0 +1,75 @@
+"""
+One database execute wrapper per request, shared by every query observer.
+
+The write metrics (``shop_app.metrics``) and the request timings
+(``shop_app.timing``) both look at each query a request runs. They register
+an observer, a callable taking the SQL and its duration in seconds, with
+``observe_queries()`` (or ``aobserve_queries()`` in async code). The first
+observer of a request installs the wrapper on the connections and the others
+join its list, so a request never runs more than one wrapper.
+"""
+import time
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+_observers = ContextVar('shop_query_observers', default=None)
+
+def _observed_execute(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for observer in _observers.get() or ():
+            observer(sql, elapsed)
+
+def _wrap_connections():
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(_observed_execute))
+    return stack
+
+@contextmanager
+def _joined(observers, observer):
+    observers.append(observer)
+    try:
+        yield
+    finally:
+        observers.remove(observer)
+
+@contextmanager
+def observe_queries(observer):
+    """Call observer(sql, seconds) for every query run on this thread's connections"""
+    observers = _observers.get()
+    if observers is not None:
+        with _joined(observers, observer):
+            yield
+        return
+    token = _observers.set([observer])
+    try:
+        with _wrap_connections():
+            yield
+    finally:
+        _observers.reset(token)
+
+@asynccontextmanager
+async def aobserve_queries(observer):
+    """Async observe_queries()"""
+    observers = _observers.get()
+    if observers is not None:
+        with _joined(observers, observer):
+            yield
+        return
+    token = _observers.set([observer])
+    try:
+        # Connections belong to the thread the request's ORM calls run on
+        wrappers = await sync_to_async(_wrap_connections)()
+        try:
+            yield
+        finally:
+            await sync_to_async(wrappers.close)()
+    finally:
+        _observers.reset(token)
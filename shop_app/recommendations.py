@@ -0,0 +1,429 @@
+"""
+Precomputed product recommendations.
+
+"Customers also bought" comes from order co-occurrence: the batch job loads
+(order, product) pairs from OrderItem into an order x product incidence
+matrix, multiplies it by its transpose to get item-item co-purchase counts
+in one sparse product, and normalizes them to cosine similarity (so
+bestsellers do not dominate every list).
+
+"Similar products" is content based, so it also covers products that have
+never sold: each active product's name, description, category and gender
+become a TF-IDF vector and neighbours are ranked by cosine similarity. The
+full rebuild (the command) also stores the vectors with their vocabulary
+and IDF in a SimilarityIndex file. Saves that change a product's text,
+category, gender or active flag queue the product, and a background worker
+refreshes the queued products in batches against the stored index (see
+``update_similar_products``), so a save never re-vectorizes the catalog.
+
+Both store the top-K neighbours of each product in ProductRecommendation, so
+product pages read them with a single indexed query.
+"""
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+from scipy import sparse
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .caching import bump_catalog_version
+from .models import OrderItem, Product, ProductRecommendation
+
+DEFAULT_TOP_K = 10
+WRITE_BATCH_SIZE = 5000
+# Rows of the TF-IDF similarity computed per sparse product, bounds memory on large catalogs
+SIMILARITY_BLOCK_SIZE = 1000
+
+TOKEN_RE = re.compile(r'[^\W\d_]{2,}', re.UNICODE)
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from has in is it its of on or our that the this to with your you'.split()
+)
+# Repeat name terms so the product name counts more than the long description
+NAME_WEIGHT = 3
+# Product fields the content vectors are built from; saves that change none of them skip the refresh
+SIMILARITY_FIELDS = ('name', 'description', 'category_id', 'gender', 'is_active')
+
+logger = logging.getLogger(__name__)
+
+# One worker, so queued refreshes never write the index concurrently
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similar-products')
+_pending = set()
+_pending_lock = threading.Lock()
+_flush_scheduled = False
+
+def co_purchase_matrix():
+    """Return (product_ids, item-item co-purchase counts as CSR)"""
+    pairs = OrderItem.objects.values_list('order_id', 'product_id')
+    # No count= from a separate COUNT query: orders placed between the two
+    # would make the lengths disagree, so whatever the one read returns is used
+    flat = np.fromiter(
+        (value for pair in pairs.iterator(chunk_size=WRITE_BATCH_SIZE) for value in pair),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    if not len(flat):
+        return np.empty(0, dtype=np.int64), sparse.csr_matrix((0, 0))
+
+    _, order_index = np.unique(flat[:, 0], return_inverse=True)
+    product_ids, product_index = np.unique(flat[:, 1], return_inverse=True)
+
+    # Orders x products, 1 where the order contains the product (repeated lines count once)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(flat), dtype=np.float32), (order_index, product_index)),
+        shape=(order_index.max() + 1, len(product_ids)),
+    )
+    incidence.data[:] = 1
+
+    co_counts = (incidence.T @ incidence).tocsr()
+    return product_ids, co_counts
+
+def top_k_neighbours(row_ids, column_ids, similarity, top_k):
+    """Yield (product_id, [(neighbour_id, score), ...]) from a similarity CSR matrix
+
+    Rows are the products in row_ids, columns the products in column_ids; a
+    product is never its own neighbour and zero scores are dropped.
+    """
+    similarity = similarity.tocsr()
+    for row in range(similarity.shape[0]):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        scores = similarity.data[start:end]
+        columns = similarity.indices[start:end]
+        keep = (scores > 0) & (column_ids[columns] != row_ids[row])
+        scores, columns = scores[keep], columns[keep]
+        if not len(scores):
+            continue
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            scores, columns = scores[best], columns[best]
+        order = np.lexsort((column_ids[columns], -scores))
+        yield int(row_ids[row]), [(int(column_ids[columns[i]]), float(scores[i])) for i in order]
+
+def co_purchase_similarity(co_counts):
+    """Cosine similarity from co-purchase counts; the diagonal holds each product's order count"""
+    norms = np.sqrt(co_counts.diagonal())
+    norms[norms == 0] = 1
+    scale = sparse.diags(1 / norms)
+    return scale @ co_counts @ scale
+
+def store_recommendations(kind, neighbours, product_ids=None):
+    """Replace stored recommendations of a kind (optionally only for some products)
+
+    Product pages show recommendations and are revalidated against the
+    catalog version and their product's updated_at: a full rebuild bumps the
+    version, a partial one only touches the products it rewrote.
+    """
+    existing = ProductRecommendation.objects.filter(kind=kind)
+    if product_ids is not None:
+        existing = existing.filter(product_id__in=product_ids)
+
+    written = 0
+    with transaction.atomic():
+        existing.delete()
+        batch = []
+        for product_id, items in neighbours:
+            batch.extend(
+                ProductRecommendation(
+                    product_id=product_id, recommended_id=recommended_id,
+                    kind=kind, rank=rank, score=score,
+                )
+                for rank, (recommended_id, score) in enumerate(items, start=1)
+            )
+            if len(batch) >= WRITE_BATCH_SIZE:
+                ProductRecommendation.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        ProductRecommendation.objects.bulk_create(batch)
+        written += len(batch)
+        if product_ids is not None:
+            Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+    if product_ids is None:
+        bump_catalog_version()
+    return written
+
+def build_co_purchase_recommendations(top_k=DEFAULT_TOP_K):
+    """Rebuild the "customers also bought" table, returns the number of rows written"""
+    product_ids, co_counts = co_purchase_matrix()
+    similarity = co_purchase_similarity(co_counts)
+    return store_recommendations(
+        ProductRecommendation.CO_PURCHASE,
+        top_k_neighbours(product_ids, product_ids, similarity, top_k),
+    )
+
+def product_document(name, description, category_id, gender):
+    """Terms of a product for the content index; category and gender are single tokens"""
+    terms = [term for term in TOKEN_RE.findall(name.lower()) if term not in STOP_WORDS] * NAME_WEIGHT
+    terms += [term for term in TOKEN_RE.findall(description.lower()) if term not in STOP_WORDS]
+    terms += [f'category:{category_id}', f'gender:{gender}']
+    return terms
+
+class SimilarityIndex:
+    """L2-normalized TF-IDF vectors of the active products, with the vocabulary and IDF they were built with
+
+    floors holds, per row, the lowest stored score of the product's
+    neighbour list when the list is full (0 otherwise): a change can only
+    enter a list by scoring above it.
+    """
+
+    def __init__(self, product_ids, vectors, vocabulary, idf, floors, top_k):
+        self.product_ids = product_ids
+        self.vectors = vectors
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.floors = floors
+        self.top_k = top_k
+        self.columns = {term: column for column, term in enumerate(vocabulary)}
+
+    def vectorize(self, documents):
+        """Vectors of documents with the stored weights; terms the index has never seen are ignored"""
+        rows, columns = [], []
+        for row, terms in enumerate(documents):
+            for term in terms:
+                column = self.columns.get(term)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        counts = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float64), (rows, columns)),
+            shape=(len(documents), len(self.vocabulary)),
+        )
+        return weigh_counts(counts, self.idf)
+
+    def save(self, path):
+        # Written to a new file next to the target and renamed over it, so
+        # readers and a crash never leave half an index behind
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.npz')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                np.savez(
+                    file, product_ids=self.product_ids, data=self.vectors.data, indices=self.vectors.indices,
+                    indptr=self.vectors.indptr, vocabulary=self.vocabulary, idf=self.idf, floors=self.floors,
+                    top_k=self.top_k,
+                )
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            vectors = sparse.csr_matrix(
+                (stored['data'], stored['indices'], stored['indptr']),
+                shape=(len(stored['product_ids']), len(stored['vocabulary'])),
+            )
+            return cls(
+                stored['product_ids'], vectors, stored['vocabulary'], stored['idf'], stored['floors'],
+                int(stored['top_k']),
+            )
+
+def similarity_index_path():
+    return str(settings.SHOP_SIMILARITY_INDEX_PATH)
+
+@contextmanager
+def similarity_index_lock():
+    """Hold the index exclusively, across processes, while it is read, changed and written back"""
+    with open(f'{similarity_index_path()}.lock', 'a+b') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield  # closing the file releases the lock
+            return
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+def load_similarity_index():
+    """The stored index, or None before the first full build"""
+    path = similarity_index_path()
+    if not os.path.exists(path):
+        return None
+    return SimilarityIndex.load(path)
+
+def weigh_counts(counts, idf):
+    """Sublinear tf times idf, L2-normalized per row"""
+    counts = counts.tocsr()
+    counts.sum_duplicates()
+    counts.data = 1 + np.log(counts.data)
+    vectors = counts @ sparse.diags(idf)
+    norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ vectors).tocsr()
+
+def product_documents(queryset):
+    """Return (product_ids, term lists) of the products in queryset"""
+    rows = queryset.order_by('id').values_list('id', 'name', 'description', 'category_id', 'gender')
+    product_ids, documents = [], []
+    for product_id, name, description, category_id, gender in rows.iterator(chunk_size=WRITE_BATCH_SIZE):
+        product_ids.append(product_id)
+        documents.append(product_document(name, description, category_id, gender))
+    return np.array(product_ids, dtype=np.int64), documents
+
+def build_similarity_index(top_k=DEFAULT_TOP_K):
+    """Vectorize every active product with a fresh vocabulary and IDF, ids ascending"""
+    product_ids, documents = product_documents(Product.objects.filter(is_active=True))
+    lengths = np.fromiter((len(terms) for terms in documents), dtype=np.int64, count=len(documents))
+    vocabulary, term_index = np.unique(
+        np.fromiter((term for terms in documents for term in terms), dtype=object, count=lengths.sum()),
+        return_inverse=True,
+    )
+    vocabulary = vocabulary.astype(str)
+    document_index = np.repeat(np.arange(len(documents)), lengths)
+
+    # Duplicate (document, term) entries are summed into raw term counts
+    counts = sparse.csr_matrix(
+        (np.ones(len(term_index), dtype=np.float64), (document_index, term_index)),
+        shape=(len(documents), len(vocabulary)),
+    )
+    counts.sum_duplicates()
+
+    # Smoothed idf, as in scikit-learn's TfidfVectorizer
+    document_frequency = np.bincount(counts.indices, minlength=len(vocabulary))
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+    return SimilarityIndex(
+        product_ids, weigh_counts(counts, idf), vocabulary, idf, np.zeros(len(product_ids)), top_k,
+    )
+
+def similar_neighbours(product_ids, vectors, rows, top_k):
+    """Top-K content neighbours for the given row positions, computed block by block"""
+    for start in range(0, len(rows), SIMILARITY_BLOCK_SIZE):
+        block = rows[start:start + SIMILARITY_BLOCK_SIZE]
+        similarity = vectors[block] @ vectors.T
+        yield from top_k_neighbours(product_ids[block], product_ids, similarity, top_k)
+
+def store_similar(index, rows, product_ids=None):
+    """Store the neighbour lists of the index rows and record their floors, returns the rows written"""
+    index.floors[rows] = 0
+    position = {int(product_id): row for row, product_id in enumerate(index.product_ids)}
+
+    def recording_floors(neighbours):
+        for product_id, items in neighbours:
+            if len(items) >= index.top_k:
+                index.floors[position[product_id]] = items[-1][1]
+            yield product_id, items
+
+    return store_recommendations(
+        ProductRecommendation.SIMILAR,
+        recording_floors(similar_neighbours(index.product_ids, index.vectors, rows, index.top_k)),
+        product_ids=product_ids,
+    )
+
+def build_similar_recommendations(top_k=DEFAULT_TOP_K):
+    """Rebuild the content-based "similar products" table and index, returns the number of rows written"""
+    with similarity_index_lock():
+        index = build_similarity_index(top_k)
+        written = store_similar(index, np.arange(len(index.product_ids)))
+        index.save(similarity_index_path())
+    return written
+
+def update_similar_products(changed_ids, top_k=DEFAULT_TOP_K):
+    """Refresh similar products after the given products changed, returns the number of rows written
+
+    Only the changed products are vectorized, with the stored vocabulary and
+    IDF. Recomputes the changed products' own lists, plus the lists of
+    products a changed product scored at least their floor with before the
+    change (it may have been a neighbour) or scores above it now. New terms
+    and shifts in term weights are picked up by the next full rebuild.
+
+    Without a stored index for top_k nothing is done: rebuilding the whole
+    catalog is left to ``python manage.py build_recommendations``.
+    """
+    with similarity_index_lock():
+        index = load_similarity_index()
+        if index is None or index.top_k != top_k:
+            logger.warning(
+                'No similar products index for top_k=%d, run build_recommendations to refresh %d products',
+                top_k, len(changed_ids),
+            )
+            return 0
+        return _update_index(index, changed_ids)
+
+def _update_index(index, changed_ids):
+    changed_ids = np.unique(np.asarray(list(changed_ids), dtype=np.int64))
+    old_rows = np.flatnonzero(np.isin(index.product_ids, changed_ids))
+    affected = set(changed_ids.tolist())
+    if len(old_rows):
+        before = np.asarray((index.vectors @ index.vectors[old_rows].T).max(axis=1).todense()).ravel()
+        listed = (before > 0) & (before >= index.floors)
+        affected.update(index.product_ids[listed].tolist())
+
+    # Changed products leave the index; the active ones come back with new vectors
+    new_ids, documents = product_documents(Product.objects.filter(pk__in=changed_ids.tolist(), is_active=True))
+    keep = np.ones(len(index.product_ids), dtype=bool)
+    keep[old_rows] = False
+    index.product_ids = np.concatenate([index.product_ids[keep], new_ids])
+    index.vectors = sparse.vstack([index.vectors[keep], index.vectorize(documents)]).tocsr()
+    index.floors = np.concatenate([index.floors[keep], np.zeros(len(new_ids))])
+
+    if len(new_ids):
+        new_rows = np.arange(len(index.product_ids) - len(new_ids), len(index.product_ids))
+        best = np.asarray((index.vectors @ index.vectors[new_rows].T).max(axis=1).todense()).ravel()
+        affected.update(index.product_ids[best > index.floors].tolist())
+
+    rows = np.flatnonzero(np.isin(index.product_ids, list(affected)))
+    written = store_similar(index, rows, product_ids=list(affected))
+    index.save(similarity_index_path())
+    return written
+
+def queue_similar_products(product_ids):
+    """Refresh the products' neighbours in the background, batched with other changes
+
+    The refresh runs SHOP_SIMILAR_REFRESH_DELAY seconds after the first
+    queued change; with the delay set to None nothing runs until
+    flush_similar_products() is called.
+    """
+    global _flush_scheduled
+    delay = settings.SHOP_SIMILAR_REFRESH_DELAY
+    with _pending_lock:
+        _pending.update(product_ids)
+        if delay is None or _flush_scheduled:
+            return
+        _flush_scheduled = True
+    _executor.submit(_flush_later, delay)
+
+def flush_similar_products():
+    """Refresh every queued product now, returns the number of rows written"""
+    global _flush_scheduled
+    with _pending_lock:
+        product_ids = list(_pending)
+        _pending.clear()
+        _flush_scheduled = False
+    if not product_ids:
+        return 0
+    return update_similar_products(product_ids)
+
+def _flush_later(delay):
+    time.sleep(delay)
+    try:
+        flush_similar_products()
+    except Exception:
+        logger.exception('Could not refresh similar products')
+    finally:
+        # Worker threads get their own connections, which Django would never close
+        connections.close_all()
+
+def recommended_products(product, kind, limit=4):
+    """Stored neighbours of a product, best first, in one indexed query"""
+    return Product.objects.for_listing().filter(
+        is_active=True,
+        recommended_in__product=product,
+        recommended_in__kind=kind,
+    ).order_by('recommended_in__rank')[:limit]
@@ -0,0 +1,47 @@
+"""
+Stored review aggregates on Product.
+
+Each review change is applied as a delta with F() expressions in a single
+UPDATE, so concurrent reviews never lose counts, and the average is then
+recomputed from the stored count and sum. Listing pages can show and sort
+by rating without touching the reviews table.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Cast, Coalesce, Round
+
+def average_expression():
+    # Divide as floating point (casting to NUMERIC keeps integers on SQLite) and
+    # round to the column's precision so stored values compare exactly in keysets
+    return Case(
+        When(rating_count__gt=0, then=Round(Cast(F('rating_sum'), FloatField()) / F('rating_count'), 2)),
+        default=0.0,
+        output_field=FloatField(),
+    )
+
+def apply_rating_delta(product_id, rating, delta):
+    """Add (delta=1) or remove (delta=-1) one rating from a product's aggregates"""
+    from .models import Product
+
+    with transaction.atomic():
+        Product.objects.filter(pk=product_id).update(**{
+            'rating_count': F('rating_count') + delta,
+            'rating_sum': F('rating_sum') + delta * rating,
+            f'rating_{rating}_count': F(f'rating_{rating}_count') + delta,
+        })
+        Product.objects.filter(pk=product_id).update(rating_average=average_expression())
+
+def rebuild_rating_aggregates(products):
+    """Recompute the aggregates of the given products from their reviews in one UPDATE"""
+    Review = products.model._meta.get_field('reviews').related_model
+
+    def review_subquery(aggregate, **filters):
+        reviews = Review.objects.filter(product=OuterRef('pk'), **filters).order_by().values('product')
+        return Coalesce(Subquery(reviews.annotate(value=aggregate).values('value')), 0)
+
+    products.update(
+        rating_count=review_subquery(Count('pk')),
+        rating_sum=review_subquery(Sum('rating')),
+        **{f'rating_{stars}_count': review_subquery(Count('pk'), rating=stars) for stars in range(1, 6)},
+    )
+    products.update(rating_average=average_expression())
@@ -0,0 +1,295 @@
+"""
+Synthetic shop data for benchmarks and capacity tests.
+
+The generators write categories, products, users, reviews and orders with
+``bulk_create`` in batches, one transaction per batch, so a catalog of a
+million products loads in minutes. Every step draws from its own random
+stream derived from the seed, so the same seed always produces the same
+data, and rows are upserted by their natural keys (slug, username,
+product/user, order id) so running a step again does not duplicate them.
+
+The distributions are rough imitations of a real clothing shop: category
+sizes and product popularity follow a power law, prices are log-normal
+around a per-category price point, about one product in six is on sale,
+most products have few or no reviews while a few have many, and most
+orders hold one or two items.
+
+Signal handlers do not run for bulk inserts, so the search index, the
+review aggregates and the catalog version are updated explicitly.
+"""
+import random
+from array import array
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils.text import slugify
+
+from .caching import bump_catalog_version
+from .models import Category, Order, OrderItem, Product, Review, UserProfile
+from .pricing import CENTS, calculate_shipping
+from .reviews import rebuild_rating_aggregates
+from .search import get_search_backend
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Every generated user can log in with this password
+SAMPLE_PASSWORD = 'sample-shopper'
+
+LETTER_SIZES = [list(size) for size in Product.SIZES]
+SHOE_SIZES = [[str(size), f'UK {size}'] for size in range(5, 12)]
+ONE_SIZE = [['ONE_SIZE', 'One Size']]
+
+# (name, typical price, sizes, gender or None for any), most common first
+CATEGORIES = [
+    ('T-Shirts', 599, LETTER_SIZES, None),
+    ('Shirts', 999, LETTER_SIZES, None),
+    ('Jeans', 1499, LETTER_SIZES, None),
+    ('Dresses', 1799, LETTER_SIZES, 'F'),
+    ('Sneakers', 2499, SHOE_SIZES, None),
+    ('Trousers', 1299, LETTER_SIZES, None),
+    ('Tops', 799, LETTER_SIZES, 'F'),
+    ('Hoodies', 1199, LETTER_SIZES, None),
+    ('Jackets', 2999, LETTER_SIZES, None),
+    ('Sweaters', 1599, LETTER_SIZES, None),
+    ('Shorts', 699, LETTER_SIZES, None),
+    ('Skirts', 999, LETTER_SIZES, 'F'),
+    ('Shoes', 2999, SHOE_SIZES, None),
+    ('Bags', 1999, ONE_SIZE, 'U'),
+    ('Coats', 4499, LETTER_SIZES, None),
+    ('Boots', 3499, SHOE_SIZES, None),
+    ('Belts', 499, ONE_SIZE, 'U'),
+    ('Suits', 6999, LETTER_SIZES, 'M'),
+    ('Hats', 449, ONE_SIZE, 'U'),
+    ('Scarves', 599, ONE_SIZE, 'U'),
+]
+CATEGORY_WEIGHTS = [1 / (rank + 1) ** 0.8 for rank in range(len(CATEGORIES))]
+
+ADJECTIVES = [
+    'Classic', 'Slim', 'Relaxed', 'Vintage', 'Modern', 'Casual', 'Formal', 'Summer',
+    'Winter', 'Everyday', 'Premium', 'Lightweight', 'Oversized', 'Tailored', 'Soft',
+]
+MATERIALS = ['Cotton', 'Linen', 'Denim', 'Wool', 'Silk', 'Leather', 'Fleece', 'Corduroy', 'Cashmere', 'Jersey']
+COLOURS = ['White', 'Black', 'Navy', 'Grey', 'Olive', 'Beige', 'Red', 'Blue', 'Green', 'Brown']
+SALE_DISCOUNTS = [10, 15, 20, 25, 30, 40, 50]
+SALE_DISCOUNT_WEIGHTS = [20, 15, 25, 10, 15, 10, 5]
+
+RATING_WEIGHTS = {5: 45, 4: 30, 3: 12, 2: 6, 1: 7}
+REVIEW_COMMENTS = [
+    'Fits well.', 'Great quality for the price.', 'Runs a size small.', 'Colour is slightly different.',
+    'Comfortable and soft.', 'Not what I expected.', 'Would buy again.', 'Washed well.',
+]
+
+CITIES = [
+    ('Mumbai', 'Maharashtra'), ('Pune', 'Maharashtra'), ('Delhi', 'Delhi'), ('Bengaluru', 'Karnataka'),
+    ('Chennai', 'Tamil Nadu'), ('Kolkata', 'West Bengal'), ('Hyderabad', 'Telangana'), ('Jaipur', 'Rajasthan'),
+]
+ORDER_STATUSES = ['delivered', 'shipped', 'processing', 'pending', 'cancelled']
+ORDER_STATUS_WEIGHTS = [60, 15, 10, 10, 5]
+ORDER_LINE_WEIGHTS = [50, 25, 15, 10]  # 1 to 4 lines
+
+def random_stream(seed, name):
+    """An independent random stream per generator, so one step's output does not depend on the others"""
+    return random.Random(f'{seed}:{name}')
+
+def batches(total, batch_size):
+    for start in range(0, total, batch_size):
+        yield start, min(start + batch_size, total)
+
+def popular_index(rng, count, skew=3):
+    """An index below count, low indexes being much more likely"""
+    return int(count * rng.random() ** skew)
+
+def seed_categories():
+    """Create the sample categories (if needed), returns them in CATEGORIES order"""
+    Category.objects.bulk_create([
+        Category(name=name, slug=slugify(name), description=f'{name} for every occasion.')
+        for name, price, sizes, gender in CATEGORIES
+    ], ignore_conflicts=True)
+    by_slug = Category.objects.in_bulk([slugify(name) for name, *rest in CATEGORIES], field_name='slug')
+    return [by_slug[slugify(name)] for name, *rest in CATEGORIES]
+
+def seed_catalog(product_count, seed=0, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Create the categories and product_count products, returns the categories"""
+    rng = random_stream(seed, 'products')
+    categories = seed_categories()
+    for start, end in batches(product_count, batch_size):
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                [sample_product(rng, number, categories) for number in range(start, end)],
+                update_conflicts=True,
+                unique_fields=['slug'],
+                update_fields=[
+                    'name', 'category', 'description', 'price', 'sale_price', 'stock',
+                    'available_sizes', 'gender', 'is_active', 'is_featured',
+                ],
+            )
+        if progress:
+            progress('products', end, product_count)
+
+    get_search_backend().rebuild()
+    bump_catalog_version()
+    return categories
+
+def sample_product(rng, number, categories):
+    index = rng.choices(range(len(CATEGORIES)), CATEGORY_WEIGHTS)[0]
+    category = categories[index]
+    name, typical_price, sizes, gender = CATEGORIES[index]
+    title = f'{rng.choice(ADJECTIVES)} {rng.choice(COLOURS)} {rng.choice(MATERIALS)} {name.rstrip("s")}'
+
+    # Log-normal around the category's price point, ending in 49 or 99
+    price = max(99, round(typical_price * rng.lognormvariate(0, 0.45) / 50) * 50 - 1)
+    sale_price = None
+    if rng.random() < 0.17:
+        discount = rng.choices(SALE_DISCOUNTS, SALE_DISCOUNT_WEIGHTS)[0]
+        sale_price = Decimal(price * (100 - discount) // 100).quantize(CENTS)
+    if sizes is LETTER_SIZES:
+        # Most lines skip XS and XXL
+        sizes = sizes[rng.choice([0, 1, 1, 1]):rng.choice([5, 5, 5, 6])]
+
+    return Product(
+        name=title,
+        slug=f'{slugify(title)}-{number}',
+        category=category,
+        description=f'{title}. Made from {rng.choice(MATERIALS).lower()} for a comfortable fit.',
+        price=Decimal(price).quantize(CENTS),
+        sale_price=sale_price,
+        stock=0 if rng.random() < 0.06 else int(rng.expovariate(1 / 40)) + 1,
+        available_sizes=sizes,
+        gender=gender or rng.choices('MFU', [45, 45, 10])[0],
+        is_active=rng.random() < 0.97,
+        is_featured=rng.random() < 0.005,
+    )
+
+def seed_users(user_count, seed=0, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Create user_count customers with profiles, all with the SAMPLE_PASSWORD"""
+    rng = random_stream(seed, 'users')
+    # Hashing is deliberately slow, so every user shares one hash
+    password = make_password(SAMPLE_PASSWORD)
+    for start, end in batches(user_count, batch_size):
+        with transaction.atomic():
+            users = User.objects.bulk_create(
+                [
+                    User(username=f'shopper{number}', email=f'shopper{number}@example.com', password=password)
+                    for number in range(start, end)
+                ],
+                update_conflicts=True,
+                unique_fields=['username'],
+                update_fields=['email', 'password'],
+            )
+            profiles = []
+            for user in users:
+                city, state = rng.choice(CITIES)
+                profiles.append(UserProfile(
+                    user=user, phone=f'9{rng.randrange(10 ** 9):09d}', address=f'{rng.randrange(1, 500)} Market Road',
+                    city=city, state=state, zip_code=f'{rng.randrange(110000, 860000)}',
+                ))
+            UserProfile.objects.bulk_create(
+                profiles, update_conflicts=True, unique_fields=['user'],
+                update_fields=['phone', 'address', 'city', 'state', 'zip_code'],
+            )
+        if progress:
+            progress('users', end, user_count)
+
+def seed_reviews(review_count, seed=0, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Add about review_count reviews by the existing users, spread over the existing products
+
+    Returns the number of reviews written.
+    """
+    rng = random_stream(seed, 'reviews')
+    user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    product_total = Product.objects.count()
+    if not user_ids or not product_total:
+        return 0
+
+    # paretovariate(1.5) - 1 averages 2: most products get none, a few get hundreds
+    mean = review_count / product_total
+    written = 0
+    product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+    batch = []
+    for product_id in product_ids.iterator(chunk_size=batch_size):
+        count = min(round((rng.paretovariate(1.5) - 1) * mean / 2), len(user_ids), 500)
+        for user_id in rng.sample(user_ids, count):
+            batch.append(Review(
+                product_id=product_id, user_id=user_id,
+                rating=rng.choices(list(RATING_WEIGHTS), list(RATING_WEIGHTS.values()))[0],
+                comment=rng.choice(REVIEW_COMMENTS),
+            ))
+        if len(batch) >= batch_size:
+            written += write_reviews(batch)
+            batch = []
+            if progress:
+                progress('reviews', written, review_count)
+    written += write_reviews(batch)
+    if progress:
+        progress('reviews', written, review_count)
+    bump_catalog_version()
+    return written
+
+def write_reviews(reviews):
+    if not reviews:
+        return 0
+    with transaction.atomic():
+        Review.objects.bulk_create(
+            reviews, update_conflicts=True, unique_fields=['product', 'user'], update_fields=['rating', 'comment'],
+        )
+        rebuild_rating_aggregates(Product.objects.filter(pk__in={review.product_id for review in reviews}))
+    return len(reviews)
+
+def seed_orders(order_count, seed=0, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Create order_count orders by the existing users for the active products
+
+    Returns the number of orders written; orders that already exist are skipped.
+    """
+    rng = random_stream(seed, 'orders')
+    user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    product_ids, prices = array('q'), array('q')  # Prices in cents, compact for a million products
+    for product_id, price, sale_price in Product.objects.filter(is_active=True).order_by('pk').values_list(
+        'pk', 'price', 'sale_price',
+    ).iterator(chunk_size=batch_size):
+        product_ids.append(product_id)
+        prices.append(int((sale_price or price) * 100))
+    if not user_ids or not product_ids:
+        return 0
+
+    written = 0
+    for start, end in batches(order_count, batch_size):
+        orders, lines = [], []
+        for number in range(start, end):
+            city, state = rng.choice(CITIES)
+            items = []
+            for line in range(rng.choices(range(1, 5), ORDER_LINE_WEIGHTS)[0]):
+                index = popular_index(rng, len(product_ids))
+                items.append((product_ids[index], Decimal(prices[index]) / 100, rng.choices([1, 2, 3], [85, 12, 3])[0]))
+            subtotal = sum(price * quantity for product_id, price, quantity in items)
+            payment_method = rng.choice(['COD', 'ONLINE'])
+            orders.append(Order(
+                order_id=f'{rng.getrandbits(64):016X}',
+                user_id=user_ids[popular_index(rng, len(user_ids), skew=2)],
+                status=rng.choices(ORDER_STATUSES, ORDER_STATUS_WEIGHTS)[0],
+                total_amount=subtotal + calculate_shipping(subtotal),
+                shipping_address=f'{rng.randrange(1, 500)} Market Road',
+                shipping_city=city,
+                shipping_state=state,
+                shipping_zip=f'{rng.randrange(110000, 860000)}',
+                phone=f'9{rng.randrange(10 ** 9):09d}',
+                payment_method=payment_method,
+                payment_status='paid' if payment_method == 'ONLINE' else 'pending',
+            ))
+            lines.append(items)
+
+        with transaction.atomic():
+            existing = set(Order.objects.filter(
+                order_id__in=[order.order_id for order in orders],
+            ).values_list('order_id', flat=True))
+            new = [(order, items) for order, items in zip(orders, lines) if order.order_id not in existing]
+            Order.objects.bulk_create([order for order, items in new])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_id, price=price, quantity=quantity, size='')
+                for order, items in new for product_id, price, quantity in items
+            ])
+        written += len(new)
+        if progress:
+            progress('orders', end, order_count)
+    return written
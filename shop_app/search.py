@@ -0,0 +1,216 @@
+"""
+Product search with pluggable, database-specific backends.
+
+Each backend keeps a full-text index of product name, description and
+category name in a side table keyed by product id, so searching no longer
+scans and joins the product table with LIKE. The index is kept current by
+the signal handlers in ``shop_app.signals`` and can be rebuilt at any time
+with ``python manage.py rebuild_search_index``.
+
+The backend is picked from the default database vendor, or explicitly with
+the ``SHOP_SEARCH_BACKEND`` setting (a dotted path to a backend class).
+"""
+import re
+
+from django.conf import settings
+from django.db import connection as default_connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+PRODUCT_TABLE = 'shop_app_product'
+CATEGORY_TABLE = 'shop_app_category'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+class SearchBackend:
+    """Base class for search backends"""
+
+    def __init__(self, connection=None):
+        self.connection = connection or default_connection
+
+    def setup(self):
+        """Create the index structures"""
+
+    def teardown(self):
+        """Drop the index structures"""
+
+    def rebuild(self):
+        """Re-index every product, returns the number of indexed products"""
+        return 0
+
+    def index_product(self, product):
+        self._reindex('p.id = %s', [product.pk])
+
+    def index_category(self, category):
+        self._reindex('p.category_id = %s', [category.pk])
+
+    def remove_product(self, product_id):
+        pass
+
+    def _reindex(self, where, params):
+        pass
+
+    def search(self, queryset, query):
+        """Filter queryset to products matching query, annotated with search_rank (higher is better)"""
+        raise NotImplementedError
+
+class DatabaseSearchBackend(SearchBackend):
+    """Plain LIKE matching for databases without a full-text backend"""
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(category__name__icontains=query)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+class SQLiteFTSBackend(SearchBackend):
+    """SQLite FTS5 virtual table ranked with bm25()"""
+
+    table = 'shop_app_product_fts'
+    # bm25() column weights: name, description, category name
+    weights = (10.0, 1.0, 4.0)
+
+    def setup(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "name, description, category_name, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+
+    def teardown(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+        return self._insert('1 = 1', [])
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [product_id])
+
+    def _reindex(self, where, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN (SELECT p.id FROM {PRODUCT_TABLE} p WHERE {where})",
+                params,
+            )
+        self._insert(where, params)
+
+    def _insert(self, where, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, name, description, category_name) "
+                f"SELECT p.id, p.name, p.description, c.name FROM {PRODUCT_TABLE} p "
+                f"INNER JOIN {CATEGORY_TABLE} c ON c.id = p.category_id WHERE {where}",
+                params,
+            )
+            return cursor.rowcount
+
+    @staticmethod
+    def to_match_expression(query):
+        """Turn free text into an FTS5 query of quoted prefix terms, or None"""
+        terms = WORD_RE.findall(query)
+        if not terms:
+            return None
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def search(self, queryset, query):
+        match = self.to_match_expression(query)
+        if match is None:
+            return queryset.none()
+        weights = ', '.join(str(weight) for weight in self.weights)
+        rank = RawSQL(
+            f"SELECT -bm25({self.table}, {weights}) FROM {self.table} "
+            f"WHERE {self.table} MATCH %s AND {self.table}.rowid = {PRODUCT_TABLE}.id",
+            [match],
+            output_field=FloatField(),
+        )
+        matching_ids = RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [match])
+        return queryset.filter(id__in=matching_ids).annotate(search_rank=rank)
+
+class PostgresSearchBackend(SearchBackend):
+    """PostgreSQL tsvector documents with a GIN index, ranked with ts_rank()
+
+    The stored document is the same weighted vector ``SearchVector`` builds
+    (name A, category B, description C); it is kept in a side table because
+    the category name lives in another table and cannot be part of an
+    expression index on the product table.
+    """
+
+    table = 'shop_app_product_search'
+    config = 'english'
+
+    def setup(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                f"product_id bigint PRIMARY KEY REFERENCES {PRODUCT_TABLE} (id) ON DELETE CASCADE, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_document_gin ON {self.table} USING gin (document)"
+            )
+
+    def teardown(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {self.table}")
+        return self._reindex('TRUE', [])
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE product_id = %s", [product_id])
+
+    def _reindex(self, where, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table} (product_id, document) "
+                f"SELECT p.id, "
+                f"setweight(to_tsvector('{self.config}', coalesce(p.name, '')), 'A') || "
+                f"setweight(to_tsvector('{self.config}', coalesce(c.name, '')), 'B') || "
+                f"setweight(to_tsvector('{self.config}', coalesce(p.description, '')), 'C') "
+                f"FROM {PRODUCT_TABLE} p INNER JOIN {CATEGORY_TABLE} c ON c.id = p.category_id "
+                f"WHERE {where} "
+                "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                params,
+            )
+            return cursor.rowcount
+
+    def search(self, queryset, query):
+        if not WORD_RE.search(query):
+            return queryset.none()
+        tsquery = f"websearch_to_tsquery('{self.config}', %s)"
+        rank = RawSQL(
+            f"SELECT ts_rank(s.document, {tsquery}) FROM {self.table} s "
+            f"WHERE s.product_id = {PRODUCT_TABLE}.id",
+            [query],
+            output_field=FloatField(),
+        )
+        matching_ids = RawSQL(
+            f"SELECT s.product_id FROM {self.table} s WHERE s.document @@ {tsquery}",
+            [query],
+        )
+        return queryset.filter(id__in=matching_ids).annotate(search_rank=rank)
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+def get_search_backend(connection=None):
+    """Return the configured search backend for a database connection"""
+    connection = connection or default_connection
+    backend_path = getattr(settings, 'SHOP_SEARCH_BACKEND', None)
+    if backend_path:
+        backend_class = import_string(backend_path)
+    else:
+        backend_class = VENDOR_BACKENDS.get(connection.vendor, DatabaseSearchBackend)
+    return backend_class(connection)
@@ -0,0 +1,147 @@
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import bump_catalog_version
+from .images import delete_derivatives, generate_in_background, needs_derivatives
+from .cart import get_cart_backend
+from .models import Category, Product, ProductImage, Review
+from .recommendations import SIMILARITY_FIELDS, queue_similar_products
+from .reviews import apply_rating_delta
+from .search import get_search_backend
+from .templatetags.shop_tags import PRODUCT_CARD_VARIANTS, product_card_cache_key
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    """Keep the search index in step with product changes"""
+    if raw:
+        return
+    get_search_backend().index_product(instance)
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_product(instance.pk)
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created=False, raw=False, **kwargs):
+    """Category names are indexed with their products"""
+    if raw or created:
+        return
+    get_search_backend().index_category(instance)
+
+@receiver(pre_save, sender=Product)
+def remember_similarity_fields(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._previous_similarity_fields = None
+    if raw or not instance.pk:
+        return
+    written = {name.removesuffix('_id') for name in update_fields or ()}
+    if update_fields is not None and not written & {name.removesuffix('_id') for name in SIMILARITY_FIELDS}:
+        # None of the vector fields are saved, so nothing to compare
+        instance._previous_similarity_fields = similarity_fields(instance)
+        return
+    instance._previous_similarity_fields = sender.objects.filter(pk=instance.pk).values_list(
+        *SIMILARITY_FIELDS
+    ).first()
+
+def similarity_fields(product):
+    return tuple(getattr(product, name) for name in SIMILARITY_FIELDS)
+
+@receiver(post_save, sender=Product)
+def refresh_similar_products(sender, instance, created=False, raw=False, **kwargs):
+    """Queue the product for a content-based neighbour refresh once a change to its text or category is committed"""
+    if raw:
+        return
+    if created or getattr(instance, '_previous_similarity_fields', None) != similarity_fields(instance):
+        transaction.on_commit(lambda: queue_similar_products([instance.pk]))
+
+@receiver(post_delete, sender=Product)
+def forget_similar_product(sender, instance, **kwargs):
+    product_id = instance.pk  # cleared once the delete is done
+    transaction.on_commit(lambda: queue_similar_products([product_id]))
+
+@receiver(post_delete, sender=Product)
+def invalidate_product_cards(sender, instance, **kwargs):
+    """Saving a product changes updated_at and so its card keys; deleting needs explicit cleanup"""
+    cache.delete_many([product_card_cache_key(instance, variant) for variant in PRODUCT_CARD_VARIANTS])
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_product_for_image(sender, instance, raw=False, **kwargs):
+    """Image changes bump the product's updated_at so its cached cards are re-rendered"""
+    if raw:
+        return
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+def _product_image_derivatives_saved(image):
+    Product.objects.filter(pk=image.product_id).update(updated_at=timezone.now())
+    bump_catalog_version()
+
+def _category_image_derivatives_saved(category):
+    bump_catalog_version()
+
+@receiver(post_save, sender=ProductImage)
+def generate_product_image_derivatives(sender, instance, raw=False, **kwargs):
+    """Resize new or replaced images in the background once the upload is committed"""
+    if raw or not needs_derivatives(instance.image, instance.derivatives):
+        return
+    transaction.on_commit(lambda: generate_in_background(
+        ProductImage.objects.all(), instance.pk, 'image', 'derivatives', _product_image_derivatives_saved,
+    ))
+
+@receiver(post_save, sender=Category)
+def generate_category_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw or not needs_derivatives(instance.image, instance.image_derivatives):
+        return
+    transaction.on_commit(lambda: generate_in_background(
+        Category.objects.all(), instance.pk, 'image', 'image_derivatives', _category_image_derivatives_saved,
+    ))
+
+@receiver(post_delete, sender=ProductImage)
+def delete_product_image_derivatives(sender, instance, **kwargs):
+    # Content-addressed storage shares one file between identical uploads
+    if not ProductImage.objects.filter(image=instance.image.name).exists():
+        delete_derivatives(instance.derivatives)
+
+@receiver(post_delete, sender=Category)
+def delete_category_image_derivatives(sender, instance, **kwargs):
+    if not Category.objects.filter(image=instance.image.name).exists():
+        delete_derivatives(instance.image_derivatives)
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_catalog_caches(sender, **kwargs):
+    bump_catalog_version()
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    instance._previous_rating = None
+    if not raw and instance.pk:
+        instance._previous_rating = sender.objects.filter(pk=instance.pk).values_list('rating', flat=True).first()
+
+@receiver(post_save, sender=Review)
+def add_review_to_aggregates(sender, instance, created=False, raw=False, **kwargs):
+    """Keep Product rating aggregates current as reviews are added or edited"""
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        apply_rating_delta(instance.product_id, instance.rating, 1)
+    elif previous != instance.rating:
+        apply_rating_delta(instance.product_id, previous, -1)
+        apply_rating_delta(instance.product_id, instance.rating, 1)
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_aggregates(sender, instance, **kwargs):
+    apply_rating_delta(instance.product_id, instance.rating, -1)
+
+@receiver(user_logged_in)
+def carry_over_anonymous_cart(sender, request, user, **kwargs):
+    if request is not None:
+        get_cart_backend().login(request, user)
@@ -0,0 +1,71 @@
+"""
+Content-addressed media storage.
+
+``HashedFileSystemStorage`` names every uploaded file after a hash of its
+contents, e.g. ``products/3f/3fa94c0e9b1d4a2e8c7f6b5a4d3c2b1a.jpg``. Uploading
+the same photo twice stores it once, and since a name never gets different
+contents its URL can be served with ``Cache-Control: immutable``.
+
+Every upload is hashed, whatever its name. Only image derivatives
+(``<hash>_320w.webp``, see ``shop_app.images``) keep the name they are given,
+through ``save_derivative``, so they live next to their original.
+Derivatives of files stored before hashing are hashed like any upload, so
+callers must keep the name ``save_derivative`` returns. Files no longer
+referenced by any model are removed by ``python manage.py cleanup_media``.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASH_LENGTH = 32
+CONTENT_ADDRESSED_RE = re.compile(rf'(?:^|/)([0-9a-f]{{2}})/\1[0-9a-f]{{{HASH_LENGTH - 2}}}(?:[_.][^/]*)?$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def is_content_addressed(name):
+    """Whether a stored name was derived from a content hash, so its contents never change
+
+    Hashed names live in a directory named after the hash's first two
+    characters, which a file merely named like a hash does not.
+    """
+    return bool(CONTENT_ADDRESSED_RE.search(name))
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """FileSystemStorage that stores files under <dir>/<hash[:2]>/<hash><ext> and never writes a name twice"""
+
+    def hashed_name(self, name, content):
+        directory, filename = os.path.split(name)
+        digest = content_hash(content)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], f'{digest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        # Same name means same contents: an identical upload is already stored
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def save_derivative(self, name, content):
+        """Store a file generated from a stored original, returns its name
+
+        Names derived from a hashed original are kept; the caller removes an
+        older file of the same name first. Anything else is hashed like an upload.
+        """
+        if not is_content_addressed(name):
+            return self.save(name, content)
+        return super().save(name, content)
@@ -0,0 +1,70 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from ..images import DERIVATIVE_FORMATS, MODERN_FORMATS, derivative_urls
+
+register = template.Library()
+
+PRODUCT_CARD_TIMEOUT = 60 * 60 * 24
+PRODUCT_CARD_VARIANTS = ('listing', 'featured', 'new', 'related')
+
+def product_card_cache_key(product, variant, updated_at=None):
+    """Card fragments are keyed on the product's updated_at, so saving a product invalidates them"""
+    updated_at = updated_at or product.updated_at
+    return f'product_card:{variant}:{product.pk}:{updated_at.timestamp():.6f}'
+
+@register.simple_tag
+def product_cards(products, variant='listing'):
+    """Render product cards, fetching all cached fragments with one cache multi-get"""
+    products = list(products)
+    keys = {product.pk: product_card_cache_key(product, variant) for product in products}
+    cached = cache.get_many(list(keys.values()))
+
+    cards = []
+    missing = {}
+    for product in products:
+        key = keys[product.pk]
+        if key not in cached:
+            cached[key] = missing[key] = render_to_string(
+                'shop_app/product_card.html', {'product': product, 'variant': variant}
+            )
+        cards.append(cached[key])
+
+    if missing:
+        cache.set_many(missing, PRODUCT_CARD_TIMEOUT)
+    return mark_safe(''.join(cards))
+
+def _srcset(candidates):
+    return ', '.join(f'{url} {width}w' for url, width in candidates)
+
+@register.simple_tag
+def responsive_image(field_file, derivatives, sizes='100vw', **attrs):
+    """<img> with srcset/sizes over the stored derivatives, wrapped in <picture> for WebP/AVIF
+
+    Falls back to a plain <img> of the original until its derivatives exist.
+    """
+    # data_bs_target=... becomes data-bs-target="..."
+    attributes = format_html_join(' ', '{}="{}"', sorted((name.replace('_', '-'), value) for name, value in attrs.items()))
+    derivatives = derivatives or {}
+    if derivatives.get('source') != field_file.name or not derivatives.get('formats'):
+        return format_html('<img src="{}" {}>', field_file.url, attributes)
+
+    sources = []
+    fallback = []
+    for image_format in derivatives['formats']:
+        candidates = derivative_urls(derivatives, image_format)
+        if image_format in MODERN_FORMATS:
+            if candidates:
+                sources.append((DERIVATIVE_FORMATS[image_format][1], _srcset(candidates), sizes))
+        else:
+            fallback = candidates
+    fallback.append((field_file.url, derivatives['width']))
+
+    return format_html(
+        '<picture style="display: contents">{}<img src="{}" srcset="{}" sizes="{}" {}></picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', sources),
+        field_file.url, _srcset(fallback), sizes, attributes,
+    )
@@ -1,3 +1,1100 @@
-from django.test import TestCase
+import itertools
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.template import Context, Template, engines
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .cart import DatabaseCartBackend
+from .catalog import SORT_ORDERINGS, filter_products
+from .management.commands.benchmark import Command as BenchmarkCommand
+from .metrics import db_write_metrics, reset_db_write_metrics
+from .models import (
+    Cart, CartItem, Category, Order, OrderItem, Product, ProductImage, ProductRecommendation, Review,
+)
+from .orders import OrderError, place_order
+from .pricing import cart_totals
+from .query_observers import observe_queries
+from .recommendations import (
+    build_co_purchase_recommendations, build_similar_recommendations, flush_similar_products, recommended_products,
+)
+from .sampledata import SAMPLE_PASSWORD, seed_catalog
+from .storage import is_content_addressed
+from .timing import RequestTimings, _current as current_timings
+from .views import serve_media
+
+# Logging in with the default hasher takes long enough to be reported as a slow request
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+class ProductListingQueryTests(TestCase):
+    """Listing pages must not issue per-product queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shirts', slug='shirts')
+        for i in range(15):
+            product = Product.objects.create(
+                name=f'Shirt {i}',
+                slug=f'shirt-{i}',
+                category=cls.category,
+                description='A comfortable cotton shirt.',
+                price=Decimal('999.00'),
+                sale_price=Decimal('799.00') if i % 2 else None,
+                is_featured=i < 8,
+            )
+            ProductImage.objects.create(product=product, image=f'products/shirt-{i}-back.jpg')
+            ProductImage.objects.create(product=product, image=f'products/shirt-{i}.jpg', is_primary=True)
+
+    def test_product_list_query_count(self):
+        # count, categories, facet counts, products, primary images
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('shop:product_list'))
+        # Facet counts are cached per filter state
+        with self.assertNumQueries(4):
+            self.client.get(reverse('shop:product_list'))
+        self.assertContains(response, 'products/shirt-14.jpg')
+        self.assertNotContains(response, 'products/shirt-14-back.jpg')
+
+    def test_category_detail_query_count(self):
+        # ETag validators, category, count, products, primary images
+        with self.assertNumQueries(5):
+            self.client.get(reverse('shop:category_detail', args=[self.category.slug]))
+
+    def test_home_query_count(self):
+        # featured + images, categories, latest + images
+        with self.assertNumQueries(5):
+            self.client.get(reverse('shop:home'))
+        # Served from the versioned home page cache until the catalog changes
+        with self.assertNumQueries(0):
+            self.client.get(reverse('shop:home'))
+        Product.objects.filter(slug='shirt-0').first().save()
+        with self.assertNumQueries(5):
+            self.client.get(reverse('shop:home'))
+
+    def test_listing_annotates_image_count(self):
+        product = Product.objects.for_listing().get(slug='shirt-0')
+        self.assertEqual(product.image_count, 2)
+        self.assertTrue(product.primary_image.is_primary)
+
+
+class FacetCountTests(TestCase):
+    """Each facet counts the products matching every active filter but its own"""
+
+    @classmethod
+    def setUpTestData(cls):
+        shirts = Category.objects.create(name='Shirts', slug='shirts')
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        for name, category, gender, price, size, active in [
+            ('Oxford Shirt', shirts, 'M', '400.00', 'S', True),
+            ('Linen Shirt', shirts, 'F', '800.00', 'M', True),
+            ('Silk Shirt', shirts, 'F', '1500.00', 'L', True),
+            ('Evening Shirt', shirts, 'F', '2500.00', 'M', False),
+            ('Running Shoe', shoes, 'F', '2200.00', 'M', True),
+            ('Canvas Shoe', shoes, 'M', '300.00', 'S', True),
+        ]:
+            Product.objects.create(
+                name=name, slug=name.lower().replace(' ', '-'), category=category, description=name,
+                price=Decimal(price), gender=gender, available_sizes=[[size, size]], is_active=active,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self, facets, group, key):
+        return {facet[key]: facet['count'] for facet in facets[group]}
+
+    def test_counts_under_active_filters(self):
+        facets = self.client.get(reverse('shop:product_list'), {'category': 'shirts', 'gender': 'F'}).context['facets']
+        self.assertEqual(self.counts(facets, 'categories', 'slug'), {'shirts': 2, 'shoes': 1})
+        self.assertEqual(self.counts(facets, 'genders', 'value'), {'M': 1, 'F': 2, 'U': 0})
+        self.assertEqual(self.counts(facets, 'sizes', 'value'), {'XS': 0, 'S': 0, 'M': 1, 'L': 1, 'XL': 0, 'XXL': 0})
+        self.assertEqual([bucket['count'] for bucket in facets['price_buckets']], [0, 1, 1, 0])
+
+    def test_padded_parameters_share_results_and_cache(self):
+        response = self.client.get(reverse('shop:product_list'), {'search': 'shirt', 'gender': 'F'})
+        with self.assertNumQueries(4):
+            padded = self.client.get(reverse('shop:product_list'), {'search': ' shirt ', 'gender': 'F '})
+        self.assertEqual(padded.context['facets'], response.context['facets'])
+        self.assertEqual(
+            [product.pk for product in padded.context['products']],
+            [product.pk for product in response.context['products']],
+        )
+
+
+class ProductSearchTests(TestCase):
+    """Full-text search is kept current by signals and ranked by relevance"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Outerwear', slug='outerwear')
+        cls.jacket = Product.objects.create(
+            name='Denim Jacket', slug='denim-jacket', category=cls.category,
+            description='A classic jacket.', price=Decimal('1999.00'),
+        )
+        cls.jeans = Product.objects.create(
+            name='Slim Jeans', slug='slim-jeans', category=cls.category,
+            description='Stretch denim jeans.', price=Decimal('1299.00'),
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse('shop:product_list'), {'search': query})
+        return [product.slug for product in response.context['products']]
+
+    def test_ranks_name_matches_first(self):
+        self.assertEqual(self.search('denim'), ['denim-jacket', 'slim-jeans'])
+
+    def test_prefix_and_category_matches(self):
+        self.assertEqual(self.search('jack'), ['denim-jacket'])
+        self.assertEqual(len(self.search('outerwear')), 2)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.category.name = 'Winter'
+        self.category.save()
+        self.assertEqual(self.search('outerwear'), [])
+        self.jeans.delete()
+        self.assertEqual(self.search('winter'), ['denim-jacket'])
+
+
+class PlaceOrderTests(TestCase):
+    """Order placement is batched and reserves stock"""
+
+    shipping_data = {
+        'shipping_address': '12 Main Road',
+        'shipping_city': 'Soraba',
+        'shipping_state': 'Karnataka',
+        'shipping_zip': '577429',
+        'shipping_country': 'India',
+        'phone': '9999999999',
+        'payment_method': 'COD',
+        'notes': '',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret-pass')
+        cls.category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.products = [
+            Product.objects.create(
+                name=f'Shirt {i}', slug=f'shirt-{i}', category=cls.category,
+                description='Cotton shirt.', price=Decimal('100.00'),
+                sale_price=Decimal('80.00') if i % 2 else None, stock=5,
+            )
+            for i in range(30)
+        ]
+
+    def make_cart(self, products, quantity=1):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=quantity, size='M') for product in products
+        ])
+        return cart
+
+    def count_queries(self, cart):
+        with CaptureQueriesContext(connection) as queries:
+            place_order(self.user, cart, self.shipping_data)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        single = self.count_queries(self.make_cart(self.products[:1]))
+        self.assertEqual(self.count_queries(self.make_cart(self.products[1:])), single)
+
+    def test_decrements_stock_and_records_prices(self):
+        order = place_order(self.user, self.make_cart(self.products[:2], quantity=2), self.shipping_data)
+        self.assertEqual(order.total_amount, Decimal('460.00'))
+        self.assertEqual(sorted(order.items.values_list('price', flat=True)), [Decimal('80.00'), Decimal('100.00')])
+        updated_at = self.products[0].updated_at
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 3)
+        # Stock is part of the product page ETag, so orders leave updated_at alone
+        self.assertEqual(self.products[0].updated_at, updated_at)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_rejects_orders_beyond_stock(self):
+        cart = self.make_cart(self.products[:1], quantity=6)
+        with self.assertRaises(OrderError):
+            place_order(self.user, cart, self.shipping_data)
+        self.assertFalse(Order.objects.exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 5)
+
+    def test_confirmation_query_count_does_not_grow_with_order_size(self):
+        self.client.force_login(self.user)
+
+        def count_page_queries(products):
+            order = place_order(self.user, self.make_cart(products), self.shipping_data)
+            url = reverse('shop:order_confirmation', args=[order.order_id])
+            cache.clear()  # Both pages compute the cart badge
+            with CaptureQueriesContext(connection) as queries:
+                self.assertContains(self.client.get(url), products[-1].name)
+            return len(queries)
+
+        single = count_page_queries(self.products[:1])
+        self.assertEqual(count_page_queries(self.products[1:]), single)
+
+
+class CartTotalsTests(TestCase):
+    def test_totals_in_one_query(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cart = Cart.objects.create(session_key='abc')
+        for i, sale_price in enumerate([None, Decimal('150.00'), Decimal('250.00')]):
+            product = Product.objects.create(
+                name=f'Shirt {i}', slug=f'shirt-{i}', category=category,
+                description='Cotton shirt.', price=Decimal('200.00'), sale_price=sale_price,
+            )
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+        with self.assertNumQueries(1):
+            totals = cart_totals(cart)
+        # A sale price above the list price is ignored, as in Product.current_price
+        self.assertEqual(totals['subtotal'], Decimal('1100.00'))
+        self.assertEqual(totals['shipping'], Decimal('0'))
+        self.assertEqual(totals['total_quantity'], 6)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class CartSummaryTests(TestCase):
+    """The cart badge reads a cached summary that cart changes keep current"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.shirt = Product.objects.create(
+            name='Shirt', slug='shirt', category=category, description='Cotton.', price=Decimal('400.00'),
+        )
+        cls.tie = Product.objects.create(
+            name='Tie', slug='tie', category=category, description='Silk.', price=Decimal('150.00'),
+            sale_price=Decimal('100.00'),
+        )
+        cls.user = User.objects.create_user('shopper', password='secret-pass')
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='shopper', password='secret-pass')
+
+    def post(self, name, data):
+        return self.client.post(reverse(f'shop:{name}'), data, content_type='application/json').json()
+
+    def summary(self):
+        return self.client.get(reverse('shop:cart_summary')).json()
+
+    def cached(self):
+        summary = cache.get(f'cart_summary:user:{self.user.pk}')
+        return summary['item_count'], summary['total_quantity'], str(summary['subtotal'])
+
+    def test_empty_cart(self):
+        self.assertEqual(self.summary(), {'item_count': 0, 'total_quantity': 0, 'subtotal': '0.00'})
+
+    def test_changes_refresh_the_cached_summary(self):
+        self.post('add_to_cart', {'product_id': self.shirt.pk, 'size': 'M'})
+        self.assertEqual(self.cached(), (1, 1, '400.00'))
+        self.post('add_to_cart', {'product_id': self.tie.pk, 'quantity': 2})
+        self.assertEqual(self.cached(), (2, 3, '600.00'))
+
+        tie_line = CartItem.objects.get(product=self.tie)
+        self.post('update_cart_item', {'item_id': tie_line.pk, 'quantity': 4})
+        self.assertEqual(self.cached(), (2, 5, '800.00'))
+        # The endpoint answers from the cache without touching the cart tables
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.summary(), {'item_count': 2, 'total_quantity': 5, 'subtotal': '800.00'})
+        self.assertFalse([query for query in queries if 'shop_app_cart' in query['sql']])
+
+        self.post('remove_from_cart', {'item_id': tie_line.pk})
+        self.assertEqual(self.cached(), (1, 1, '400.00'))
+        self.assertEqual(self.summary(), {'item_count': 1, 'total_quantity': 1, 'subtotal': '400.00'})
+
+    def test_adding_to_a_line_keeps_concurrent_adds(self):
+        self.post('add_to_cart', {'product_id': self.shirt.pk, 'size': 'M'})
+        get_or_create = CartItem.objects.get_or_create
+
+        def add_concurrently(**kwargs):
+            line, created = get_or_create(**kwargs)
+            # Another request adds one between this one's read and write
+            CartItem.objects.filter(pk=line.pk).update(quantity=F('quantity') + 1)
+            return line, created
+
+        request = RequestFactory().post('/')
+        request.user = self.user
+        with mock.patch.object(CartItem.objects, 'get_or_create', add_concurrently):
+            DatabaseCartBackend().add_item(request, self.shirt, 2, 'M')
+        self.assertEqual(CartItem.objects.get(product=self.shirt).quantity, 4)
+
+
+class ProductCardCacheTests(TestCase):
+    """Product cards are rendered once and re-rendered when the product changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.product = Product.objects.create(
+            name='Shirt', slug='shirt', category=category, description='Cotton.', price=Decimal('400.00'),
+        )
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def render(self):
+        products = Product.objects.for_listing().filter(pk=self.product.pk)
+        return Template('{% load shop_tags %}{% product_cards products %}').render(Context({'products': products}))
+
+    def test_cached_until_the_product_changes(self):
+        first = self.render()
+        self.assertIn('400', first)
+        with self.assertTemplateNotUsed('shop_app/product_card.html'):
+            self.assertEqual(self.render(), first)
+
+        self.product.sale_price = Decimal('300.00')
+        self.product.save()
+        with self.assertTemplateUsed('shop_app/product_card.html'):
+            repriced = self.render()
+        self.assertIn('300', repriced)
+
+        buffer = BytesIO()
+        Image.new('RGB', (100, 100), 'navy').save(buffer, 'JPEG')
+        ProductImage.objects.create(
+            product=self.product, image=SimpleUploadedFile('shirt.jpg', buffer.getvalue()), is_primary=True,
+        )
+        with self.assertTemplateUsed('shop_app/product_card.html'):
+            self.assertIn('<img', self.render())
+
+
+class ExplainQueriesTests(TestCase):
+    """The EXPLAIN audit covers every sort option and finds no full scans"""
+
+    def test_every_sort_uses_an_index(self):
+        out = StringIO()
+        call_command('explain_queries', fail_on_scan=True, stdout=out)
+        for sort in SORT_ORDERINGS:
+            self.assertIn(f'OK         product_list: sort={sort}', out.getvalue())
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+
+class ProductFeedTests(TestCase):
+    """Cursor pagination walks the catalog without COUNT or OFFSET"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        for i in range(30):
+            Product.objects.create(
+                name=f'Shirt {i % 7}', slug=f'shirt-{i}', category=category,
+                description='Cotton shirt.', price=Decimal(100 + i % 5),
+            )
+
+    def walk(self, sort):
+        ids, cursor = [], None
+        while True:
+            params = {'sort': sort, **({'cursor': cursor} if cursor else {})}
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(reverse('shop:product_feed'), params).json()
+            self.assertFalse(any('COUNT(*)' in q['sql'] or 'OFFSET' in q['sql'] for q in queries))
+            ids += [product['id'] for product in data['results']]
+            cursor = data['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_pages_match_full_ordering(self):
+        for sort, ordering in [('price_low', ('price', 'id')), ('price_high', ('-price', '-id')),
+                               ('name', ('name', 'id')), ('newest', ('-created_at', '-id'))]:
+            with self.subTest(sort=sort):
+                expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+                self.assertEqual(self.walk(sort), expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('shop:product_feed'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ReviewAggregateTests(TestCase):
+    """Product rating aggregates follow review changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.users = [User.objects.create_user(f'reviewer{i}') for i in range(3)]
+        cls.product = Product.objects.create(
+            name='Shirt', slug='shirt', category=cls.category,
+            description='Cotton shirt.', price=Decimal('100.00'),
+        )
+        cls.other = Product.objects.create(
+            name='Other', slug='other', category=cls.category,
+            description='Cotton shirt.', price=Decimal('100.00'),
+        )
+
+    def test_add_edit_delete(self):
+        reviews = [
+            Review.objects.create(product=self.product, user=user, rating=rating, comment='ok')
+            for user, rating in zip(self.users, [5, 4, 4])
+        ]
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_sum), (3, 13))
+        self.assertEqual(self.product.rating_average, Decimal('4.33'))
+        self.assertEqual(self.product.rating_4_count, 2)
+
+        reviews[0].rating = 1
+        reviews[0].save()
+        reviews[1].delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_sum), (2, 5))
+        self.assertEqual((self.product.rating_1_count, self.product.rating_4_count, self.product.rating_5_count), (1, 1, 0))
+        self.assertEqual(self.product.rating_average, Decimal('2.50'))
+
+    def test_top_rated_sort(self):
+        Review.objects.create(product=self.other, user=self.users[0], rating=5, comment='great')
+        Review.objects.create(product=self.product, user=self.users[0], rating=3, comment='fine')
+        response = self.client.get(reverse('shop:product_list'), {'sort': 'top_rated'})
+        self.assertEqual([product.slug for product in response.context['products']], ['other', 'shirt'])
+
+
+class CoPurchaseRecommendationTests(TestCase):
+    """Recommendations are built from orders that share products"""
+
+    def test_ranks_by_cosine_similarity(self):
+        user = User.objects.create_user('buyer')
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        shirt, tie, socks, hat = [
+            Product.objects.create(
+                name=name, slug=name, category=category,
+                description='Cotton.', price=Decimal('100.00'),
+            )
+            for name in ['shirt', 'tie', 'socks', 'hat']
+        ]
+        baskets = [[shirt, tie], [shirt, tie], [shirt, socks], [socks], [socks], [hat]]
+        for basket in baskets:
+            order = Order.objects.create(
+                user=user, total_amount=Decimal('100.00'), **PlaceOrderTests.shipping_data
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price=product.price) for product in basket
+            ])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(build_co_purchase_recommendations(top_k=5), 4)
+        # The pairs are read once, not sized by a COUNT that new orders could outdate
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+        self.assertEqual(list(recommended_products(shirt, ProductRecommendation.CO_PURCHASE)), [tie, socks])
+        self.assertEqual(list(recommended_products(hat, ProductRecommendation.CO_PURCHASE)), [])
+
+        response = self.client.get(reverse('shop:product_detail', args=[tie.slug]))
+        self.assertEqual(list(response.context['related_products']), [shirt])
+
+
+@override_settings(SHOP_SIMILAR_REFRESH_DELAY=None)
+class SimilarProductTests(TestCase):
+    """Content-based neighbours cover products that have never sold"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts = Category.objects.create(name='Shirts', slug='shirts')
+        cls.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        cls.linen = cls.make('Linen Shirt', 'Breathable linen shirt for summer.', cls.shirts)
+        cls.oxford = cls.make('Oxford Shirt', 'Crisp cotton oxford shirt.', cls.shirts)
+        cls.sneaker = cls.make('Canvas Sneaker', 'Lightweight canvas sneaker.', cls.shoes)
+
+    @classmethod
+    def make(cls, name, description, category):
+        return Product.objects.create(
+            name=name, slug=name.lower().replace(' ', '-'), category=category,
+            description=description, price=Decimal('100.00'),
+        )
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.index_path = f'{directory}/similarity.npz'
+        self.enterContext(override_settings(SHOP_SIMILARITY_INDEX_PATH=self.index_path))
+        flush_similar_products()
+
+    def similar(self, product):
+        return list(recommended_products(product, ProductRecommendation.SIMILAR))
+
+    def test_build_and_incremental_update(self):
+        build_similar_recommendations()
+        self.assertEqual(self.similar(self.linen)[0], self.oxford)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            newcomer = self.make('Linen Sneaker', 'Summer linen sneaker, breathable canvas.', self.shoes)
+        self.assertEqual(self.similar(newcomer), [])
+        with self.assertNumQueries(6):
+            flush_similar_products()
+        self.assertEqual(self.similar(newcomer)[0], self.sneaker)
+        self.assertIn(newcomer, self.similar(self.linen))
+
+        response = self.client.get(reverse('shop:product_detail', args=[newcomer.slug]))
+        self.assertEqual(list(response.context['related_products']), self.similar(newcomer))
+
+        # Stock and price do not change the vectors
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            newcomer.stock = 3
+            newcomer.save()
+            Product.objects.get(pk=self.oxford.pk).save(update_fields=['price'])
+        self.assertEqual(len(callbacks), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            newcomer.delete()
+        flush_similar_products()
+        self.assertNotIn(newcomer, self.similar(self.linen))
+
+    def test_saves_never_rebuild_the_catalog(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            newcomer = self.make('Linen Sneaker', 'Summer linen sneaker, breathable canvas.', self.shoes)
+        with self.assertLogs('shop_app.recommendations', 'WARNING'), self.assertNumQueries(0):
+            self.assertEqual(flush_similar_products(), 0)
+        self.assertEqual(self.similar(newcomer), [])
+        self.assertFalse(os.path.exists(self.index_path))
+
+
+class LazyCartTests(TestCase):
+    """Browsing anonymously writes nothing until something is added to the cart"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.product = Product.objects.create(
+            name='Shirt', slug='shirt', category=category,
+            description='Cotton shirt.', price=Decimal('100.00'),
+        )
+
+    def setUp(self):
+        reset_db_write_metrics()
+
+    def test_read_only_visit_writes_nothing(self):
+        for url in [reverse('shop:home'), reverse('shop:product_list'),
+                    reverse('shop:product_detail', args=['shirt']), reverse('shop:cart')]:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.get(reverse('shop:cart_summary'))
+
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(db_write_metrics()['anonymous_page_views'], 4)
+        self.assertEqual(db_write_metrics()['anonymous_db_writes'], 0)
+
+    def test_add_to_cart_creates_the_cart(self):
+        response = self.client.post(
+            reverse('shop:add_to_cart'), {'product_id': self.product.pk, 'quantity': 2},
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['cart_count'], 1)
+        self.assertEqual(Cart.objects.get().items.get().quantity, 2)
+        response = self.client.get(reverse('shop:cart'))
+        self.assertContains(response, 'Shirt')
+        self.assertEqual(response.wsgi_request.db_writes, 0)
+
+
+class AsyncCartTests(TestCase):
+    """The cart endpoints run as async views"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.product = Product.objects.create(
+            name='Shirt', slug='shirt', category=category,
+            description='Cotton shirt.', price=Decimal('100.00'),
+        )
+
+    async def post(self, name, data):
+        response = await self.async_client.post(reverse(f'shop:{name}'), data, content_type='application/json')
+        return response.json()
+
+    async def test_cart_round_trip(self):
+        await self.post('add_to_cart', {'product_id': self.product.pk, 'size': 'M'})
+        data = await self.post('add_to_cart', {'product_id': self.product.pk, 'quantity': 2, 'size': 'M'})
+        self.assertEqual(data['cart_count'], 1)
+        item = await CartItem.objects.aget()
+        self.assertEqual(item.quantity, 3)
+
+        await self.post('update_cart_item', {'item_id': item.pk, 'quantity': 5})
+        summary = (await self.async_client.get(reverse('shop:cart_summary'))).json()
+        self.assertEqual((summary['item_count'], summary['total_quantity']), (1, 5))
+
+        self.assertFalse((await self.post('remove_from_cart', {'item_id': 'nope'}))['success'])
+        data = await self.post('remove_from_cart', {'item_id': item.pk})
+        self.assertEqual(data['cart_count'], 0)
+        self.assertFalse(await CartItem.objects.aexists())
+
+
+@override_settings(SHOP_CART_BACKEND='shop_app.cart.CookieCartBackend', PASSWORD_HASHERS=FAST_HASHERS)
+class CookieCartTests(TestCase):
+    """Anonymous carts live in a signed cookie until login"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.shirt = Product.objects.create(
+            name='Shirt', slug='shirt', category=category,
+            description='Cotton shirt.', price=Decimal('400.00'),
+        )
+        cls.tie = Product.objects.create(
+            name='Tie', slug='tie', category=category,
+            description='Silk tie.', price=Decimal('300.00'), sale_price=Decimal('250.00'),
+        )
+        cls.user = User.objects.create_user('shopper', password='secret-pass')
+
+    def post(self, name, data):
+        return self.client.post(reverse(f'shop:{name}'), data, content_type='application/json').json()
+
+    def test_cart_without_database_rows(self):
+        self.post('add_to_cart', {'product_id': self.shirt.pk, 'quantity': 2, 'size': 'M'})
+        data = self.post('add_to_cart', {'product_id': self.tie.pk})
+        self.assertEqual(data['cart_count'], 2)
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Session.objects.exists())
+
+        self.post('update_cart_item', {'item_id': f'{self.shirt.pk}:M', 'quantity': 3})
+        response = self.client.get(reverse('shop:cart'))
+        self.assertEqual(response.context['subtotal'], Decimal('1450.00'))
+        self.assertEqual(response.context['shipping'], Decimal('0'))
+
+        data = self.post('remove_from_cart', {'item_id': f'{self.tie.pk}:'})
+        self.assertEqual(data['cart_count'], 1)
+        self.assertFalse(self.post('remove_from_cart', {'item_id': 'nope'})['success'])
+
+    def test_summary_prices_like_database_carts(self):
+        # A sale price above the list price is ignored, as in Product.current_price
+        scarf = Product.objects.create(
+            name='Scarf', slug='scarf', category=self.shirt.category,
+            description='Wool scarf.', price=Decimal('200.00'), sale_price=Decimal('260.00'),
+        )
+        cart = Cart.objects.create(user=self.user)
+        for product, quantity in [(self.shirt, 2), (self.tie, 1), (scarf, 3)]:
+            self.post('add_to_cart', {'product_id': product.pk, 'quantity': quantity})
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        totals = cart_totals(cart)
+        self.assertEqual(self.client.get(reverse('shop:cart_summary')).json(), {
+            'item_count': totals['item_count'], 'total_quantity': totals['total_quantity'],
+            'subtotal': str(totals['subtotal']),
+        })
+
+    def test_tampered_cookie_is_ignored(self):
+        self.post('add_to_cart', {'product_id': self.shirt.pk})
+        self.client.cookies['shop_cart'] = self.client.cookies['shop_cart'].value + 'x'
+        self.assertEqual(self.client.get(reverse('shop:cart_summary')).json()['item_count'], 0)
+
+    def test_materialized_at_login(self):
+        existing = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=existing, product=self.shirt, size='M', quantity=1)
+        self.post('add_to_cart', {'product_id': self.shirt.pk, 'quantity': 2, 'size': 'M'})
+        self.post('add_to_cart', {'product_id': self.tie.pk})
+
+        response = self.client.post(reverse('login'), {'username': 'shopper', 'password': 'secret-pass'})
+        self.assertEqual(response.cookies['shop_cart'].value, '')
+        items = {(item.product_id, item.size): item.quantity for item in existing.items.all()}
+        self.assertEqual(items, {(self.shirt.pk, 'M'): 3, (self.tie.pk, ''): 1})
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class CartMergeTests(TestCase):
+    """The session cart is merged into the user's cart at login"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.shirt, cls.tie = [
+            Product.objects.create(
+                name=name, slug=name, category=category,
+                description='Cotton.', price=Decimal('100.00'),
+            )
+            for name in ['shirt', 'tie']
+        ]
+        cls.user = User.objects.create_user('shopper', password='secret-pass')
+
+    def add(self, product, quantity, size=''):
+        self.client.post(
+            reverse('shop:add_to_cart'), {'product_id': product.pk, 'quantity': quantity, 'size': size},
+            content_type='application/json',
+        )
+
+    def login(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('login'), {'username': 'shopper', 'password': 'secret-pass'})
+        return [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "shop_app_cartitem"')]
+
+    def test_merges_into_existing_cart(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.shirt, size='M', quantity=1)
+        self.add(self.shirt, 2, 'M')
+        self.add(self.tie, 1)
+
+        inserts = self.login()
+        self.assertEqual(len(inserts), 1)
+        self.assertIn('ON CONFLICT', inserts[0])
+        self.assertEqual(
+            set(cart.items.values_list('product_id', 'size', 'quantity')),
+            {(self.shirt.pk, 'M', 3), (self.tie.pk, '', 1)},
+        )
+        self.assertEqual(Cart.objects.get(), cart)
+        self.assertEqual(self.client.get(reverse('shop:cart_summary')).json()['item_count'], 2)
+
+    def test_user_without_cart(self):
+        self.add(self.tie, 2)
+        self.login()
+        cart = Cart.objects.get()
+        self.assertEqual(cart.user, self.user)
+        self.assertEqual(cart.items.get().quantity, 2)
+
+
+class CleanupCartsTests(TestCase):
+    def test_deletes_idle_anonymous_carts_and_expired_sessions(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        product = Product.objects.create(
+            name='Shirt', slug='shirt', category=category, description='Cotton.', price=Decimal('100.00'),
+        )
+        user = User.objects.create_user('shopper')
+        carts = [Cart.objects.create(session_key=f'session-{i}') for i in range(7)]
+        user_cart = Cart.objects.create(user=user)
+        for cart in carts + [user_cart]:
+            CartItem.objects.create(cart=cart, product=product)
+        long_ago = timezone.now() - timedelta(days=40)
+        Cart.objects.update(updated_at=long_ago)
+        CartItem.objects.exclude(cart=carts[0]).update(added_at=long_ago)
+        Session.objects.create(session_key='expired', session_data='', expire_date=long_ago)
+        Session.objects.create(session_key='current', session_data='', expire_date=timezone.now() + timedelta(days=1))
+
+        out = StringIO()
+        call_command('cleanup_carts', days=30, batch_size=2, stdout=out)
+
+        self.assertEqual(set(Cart.objects.all()), {carts[0], user_cart})
+        self.assertEqual(CartItem.objects.count(), 2)
+        self.assertEqual(list(Session.objects.values_list('pk', flat=True)), ['current'])
+        self.assertIn('deleted 12 rows', out.getvalue())
+
+
+class ImageDerivativeTests(TestCase):
+    """Resized WebP/JPEG copies are generated and offered through srcset"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def make_image(self):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'navy').save(buffer, 'JPEG')
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        product = Product.objects.create(
+            name='Shirt', slug='shirt', category=category, description='Cotton.', price=Decimal('100.00'),
+        )
+        return ProductImage.objects.create(
+            product=product, image=SimpleUploadedFile('shirt.jpg', buffer.getvalue()), is_primary=True,
+        )
+
+    def test_backfill_and_srcset(self):
+        image = self.make_image()
+        template = Template('{% load shop_tags %}{% responsive_image image.image image.derivatives sizes="50vw" alt="Shirt" %}')
+        self.assertNotIn('srcset', template.render(Context({'image': image})))
+
+        call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives['formats']['JPEG'], [320, 640])
+        self.assertEqual(image.derivatives['formats']['WEBP'], [320, 640])
+        stem = image.image.name[:-len('.jpg')]
+        with image.image.storage.open(f'{stem}_320w.webp') as derivative:
+            self.assertEqual(Image.open(derivative).size, (320, 240))
+
+        html = template.render(Context({'image': image}))
+        self.assertIn(f'<source type="image/webp" srcset="/media/{stem}_320w.webp 320w, '
+                      f'/media/{stem}_640w.webp 640w" sizes="50vw">', html)
+        self.assertIn(f'srcset="/media/{stem}_320w.jpg 320w, /media/{stem}_640w.jpg 640w, '
+                      f'/media/{stem}.jpg 800w" sizes="50vw" alt="Shirt"', html)
+
+        image.delete()
+        self.assertFalse(image.image.storage.exists(f'{stem}_320w.webp'))
+
+    def test_hash_shaped_upload_names_are_hashed(self):
+        image = self.make_image()
+        name = '0123456789abcdef0123456789abcdef.jpg'
+        first = ProductImage.objects.create(product=image.product, image=SimpleUploadedFile(name, b'first upload'))
+        second = ProductImage.objects.create(product=image.product, image=SimpleUploadedFile(name, b'second upload'))
+        self.assertNotEqual(first.image.name, second.image.name)
+        for stored, contents in [(first, b'first upload'), (second, b'second upload')]:
+            with stored.image.open('rb') as file:
+                self.assertEqual(file.read(), contents)
+        # Only names in their hash directory are served as immutable
+        self.assertTrue(is_content_addressed(first.image.name))
+        self.assertFalse(is_content_addressed(f'products/{name}'))
+
+    def test_legacy_source_names(self):
+        image = self.make_image()
+        # Uploaded before content-addressed storage: stored under its own name
+        legacy = 'products/shirt.jpg'
+        with image.image.open('rb') as original:
+            FileSystemStorage(location=image.image.storage.location).save(legacy, original)
+        ProductImage.objects.filter(pk=image.pk).update(image=legacy)
+
+        call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        image.refresh_from_db()
+        storage = image.image.storage
+        names = [name for stored in image.derivatives['names'].values() for name in stored]
+        self.assertRegex(names[0], r'^products/([0-9a-f]{2})/\1[0-9a-f]{30}\.\w+$')
+        self.assertTrue(all(storage.exists(name) for name in names))
+        html = Template('{% load shop_tags %}{% responsive_image image.image image.derivatives %}').render(
+            Context({'image': image})
+        )
+        self.assertIn(f'/media/{image.derivatives["names"]["JPEG"][0]} 320w', html)
+
+        call_command('cleanup_media', min_age=0, stdout=StringIO())
+        self.assertTrue(all(storage.exists(name) for name in names))
+
+    def test_content_addressed_uploads(self):
+        image = self.make_image()
+        self.assertRegex(image.image.name, r'^products/([0-9a-f]{2})/\1[0-9a-f]{30}\.jpg$')
+        with image.image.open('rb') as original:
+            duplicate = ProductImage.objects.create(
+                product=image.product, image=SimpleUploadedFile('copy.jpg', original.read()),
+            )
+        self.assertEqual(duplicate.image.name, image.image.name)
+
+        response = serve_media(RequestFactory().get('/'), image.image.name)
+        self.assertIn('immutable', response['Cache-Control'])
+
+        # Deleting one of two identical uploads keeps the shared file and derivatives
+        call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        duplicate.delete()
+        out = StringIO()
+        call_command('cleanup_media', min_age=0, stdout=out)
+        self.assertIn('Deleted 0 unreferenced files', out.getvalue())
+
+        image.refresh_from_db()
+        image.delete()
+        call_command('cleanup_media', min_age=0, stdout=out)
+        self.assertIn('Deleted 1 unreferenced files', out.getvalue())
+        self.assertFalse(image.image.storage.exists(image.image.name))
+
+
+class ConditionalGetTests(TestCase):
+    """Unchanged catalog and order pages are answered with 304 Not Modified"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.product = Product.objects.create(
+            name='Shirt', slug='shirt', category=cls.category, description='Cotton.', price=Decimal('100.00'),
+        )
+        cls.user = User.objects.create_user('reviewer', password='secret-pass')
+
+    def revalidate(self, url, response):
+        headers = {'If-None-Match': response['ETag']}
+        if response.has_header('Last-Modified'):
+            headers['If-Modified-Since'] = response['Last-Modified']
+        return self.client.get(url, headers=headers)
+
+    def test_product_detail(self):
+        url = reverse('shop:product_detail', args=['shirt'])
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        # A new review changes the page
+        Review.objects.create(product=self.product, user=self.user, rating=4, comment='Nice')
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_selling_out_changes_the_product_page(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=3)
+        url = reverse('shop:product_detail', args=['shirt'])
+        response = self.client.get(url)
+        self.assertContains(response, 'In Stock (3 available)')
+
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=3, size='M')
+        place_order(self.user, cart, PlaceOrderTests.shipping_data)
+        changed = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotContains(changed, 'In Stock')
+
+    def test_viewer_is_part_of_the_etag(self):
+        url = reverse('shop:category_detail', args=['shirts'])
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        self.client.post(
+            reverse('shop:add_to_cart'), {'product_id': self.product.pk}, content_type='application/json',
+        )
+        changed = self.revalidate(url, response)
+        self.assertEqual(changed.status_code, 200)
+        self.assertFalse(changed.has_header('Last-Modified'))
+
+        self.client.login(username='reviewer', password='secret-pass')
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': changed['ETag']}).status_code, 200)
+
+
+@override_settings(SHOP_TIMING_HEADER=True)
+class ServerTimingTests(TestCase):
+    """Requests report where their time went"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        Product.objects.create(
+            name='Shirt', slug='shirt', category=category, description='Cotton.', price=Decimal('100.00'),
+        )
+
+    def test_header_and_log_line(self):
+        with self.assertLogs('shop_app.timing', 'INFO') as logs:
+            response = self.client.get(reverse('shop:product_list'))
+        timing = logs.records[0].timing
+        self.assertEqual(timing['view'], 'shop:product_list')
+        self.assertGreater(timing['db_queries'], 0)
+        self.assertGreater(timing['template_ms'], 0)
+        self.assertGreater(timing['cache_misses'], 0)
+        self.assertIn(f'desc="{timing["db_queries"]} queries"', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+
+    def test_observers_share_one_execute_wrapper(self):
+        wrappers = []
+        with self.assertLogs('shop_app.timing', 'INFO') as logs:
+            with observe_queries(lambda sql, seconds: wrappers.append(len(connection.execute_wrappers))):
+                response = self.client.get(reverse('shop:product_list'))
+        self.assertEqual(set(wrappers), {1})
+        self.assertEqual(logs.records[0].timing['db_queries'], len(wrappers))
+        self.assertEqual(response.wsgi_request.db_writes, 0)
+
+    def test_nested_renders_are_timed_once(self):
+        cache.clear()
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        self.addCleanup(current_timings.reset, token)
+        page = engines.all()[0].from_string('{% load shop_tags %}{% product_cards products %}')
+        with mock.patch('shop_app.timing.time.perf_counter', side_effect=itertools.count()):
+            page.render({'products': Product.objects.for_listing()})
+        # One outer render, one tick; the card rendered inside it adds nothing
+        self.assertEqual(timings.template_time, 1)
+
+    @override_settings(SHOP_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_instrumented(self):
+        response = self.client.get(reverse('shop:product_list'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class SampleDataTests(TestCase):
+    """populate_sample_data bulk-loads synthetic data"""
+
+    def generate(self):
+        call_command(
+            'populate_sample_data', products=60, users=8, reviews=120, orders=15, seed=1, batch_size=25,
+            stdout=StringIO(),
+        )
+
+    def test_generate_and_rerun(self):
+        self.generate()
+        counts = (Product.objects.count(), User.objects.count(), Review.objects.count(), Order.objects.count())
+        self.assertEqual(counts[:2], (60, 8))
+        self.assertEqual(counts[3], 15)
+        self.assertGreater(counts[2], 0)
+        # Bulk inserts skip the signals, the aggregates are rebuilt
+        self.assertEqual(sum(Product.objects.values_list('rating_count', flat=True)), counts[2])
+        self.assertTrue(self.client.login(username='shopper0', password=SAMPLE_PASSWORD))
+
+        # The same seed upserts the same rows
+        self.generate()
+        self.assertEqual(
+            (Product.objects.count(), User.objects.count(), Review.objects.count(), Order.objects.count()), counts,
+        )
+
+
+class BenchmarkTests(TestCase):
+    """Benchmark seeding and the baseline comparison"""
+
+    def test_seed_catalog_is_deterministic(self):
+        seed_catalog(50, seed=3)
+        first = list(Product.objects.order_by('slug').values_list('slug', 'price', 'sale_price'))
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        seed_catalog(50, seed=3)
+        self.assertEqual(list(Product.objects.order_by('slug').values_list('slug', 'price', 'sale_price')), first)
+        self.assertEqual(len(first), 50)
+
+    def test_regressions(self):
+        command = BenchmarkCommand(stdout=StringIO())
+        baseline = {'home': {'queries': 5, 'ms': 20.0}, 'cart': {'queries': 7, 'ms': 20.0}}
+        results = {
+            'home': {'queries': 5, 'ms': 25.5},  # Within the noise
+            'cart': {'queries': 8, 'ms': 20.0},  # One more query
+            'checkout': {'queries': 9, 'ms': 90.0},  # New, no baseline yet
+        }
+        self.assertEqual(command.report(results, baseline, threshold=0.25), ['cart'])
+        results['home']['ms'] = 35.0
+        self.assertEqual(command.report(results, baseline, threshold=0.25), ['home', 'cart'])
+
+        # On a machine running the calibration loop at half the speed, 35 ms is as fast as 20 ms was
+        baseline['home']['calibration_ms'] = 5.0
+        results['home']['calibration_ms'] = 10.0
+        self.assertEqual(command.report(results, baseline, threshold=0.25), ['cart'])
+
+
+class ImportCatalogTests(TestCase):
+    """import_catalog upserts products by slug from CSV and JSON Lines"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Category.objects.create(name='Shirts', slug='shirts')
+        Product.objects.create(
+            name='Old Shirt', slug='old-shirt', category=Category.objects.get(), description='Old.',
+            price=Decimal('500.00'), stock=3,
+        )
+
+    def write(self, name, content):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = f'{directory}/{name}'
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def run_import(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_upsert_and_errors(self):
+        path = self.write('catalog.csv', (
+            'slug,name,category,price,sale_price,stock,available_sizes\n'
+            'old-shirt,Renamed Shirt,shirts,600,450,7,S|M\n'
+            'new-shirt,New Shirt,shirts,800,,2,\n'
+            'bad-shirt,Bad Shirt,hats,800,,2,\n'
+        ))
+        self.run_import(path, '--dry-run')
+        self.assertEqual(Product.objects.get(slug='old-shirt').name, 'Old Shirt')
+        self.assertFalse(Product.objects.filter(slug='new-shirt').exists())
+
+        stdout, stderr = self.run_import(path)
+        self.assertIn('Created 1 and updated 1 products from 3 rows', stdout)
+        self.assertIn("catalog.csv:4: Unknown category: 'hats'", stderr)
+        old = Product.objects.get(slug='old-shirt')
+        self.assertEqual((old.name, old.price, old.sale_price, old.stock), ('Renamed Shirt', 600, 450, 7))
+        self.assertEqual(old.available_sizes, [['S', 'Small'], ['M', 'Medium']])
+        self.assertEqual(old.description, 'Old.')
+        self.assertEqual(filter_products({'search': 'renamed'})[0].get(), old)
+
+    def test_jsonl_partial_updates(self):
+        path = self.write('stock.jsonl', (
+            '{"slug": "old-shirt", "stock": 40, "is_featured": true}\n'
+            '{"slug": "missing", "stock": 1}\n'
+            'not json\n'
+        ))
+        stdout, stderr = self.run_import(path)
+        self.assertIn('updated 1 products from 3 rows', stdout)
+        self.assertIn("New product 'missing' needs name, category, price", stderr)
+        self.assertIn('stock.jsonl:3: Invalid JSON', stderr)
+        old = Product.objects.get(slug='old-shirt')
+        self.assertEqual((old.name, old.stock, old.is_featured), ('Old Shirt', 40, True))
@@ -0,0 +1,214 @@
+"""
+Per-request performance timings.
+
+``ServerTimingMiddleware`` measures, for a sample of requests, the database
+queries (count and time), template rendering, cache hits and misses and the
+total time spent below it. Each sampled request is logged to the
+``shop_app.timing`` logger as one ``key=value`` line tagged with the URL name
+(``view=shop:product_list ...``; the values are also in the record's
+``timing`` attribute), and the timings are sent as a ``Server-Timing``
+header when ``SHOP_TIMING_HEADER`` is on, so they show up in the browser's
+network panel.
+
+Settings:
+
+* ``SHOP_TIMING_SAMPLE_RATE``: fraction of requests to instrument (0 to 1).
+* ``SHOP_TIMING_SLOW_MS``: requests slower than this are logged as warnings,
+  sampled or not.
+* ``SHOP_TIMING_HEADER``: send the Server-Timing header.
+
+Template time is measured by the ``DjangoTemplates`` backend in this module,
+which must be the template backend in ``TEMPLATES``. Only the outermost
+render is timed, so templates rendered inside another (the product cards)
+are not counted twice. Queries run while a template renders count towards
+both the template and the database time. Queries are seen through
+``shop_app.query_observers``, sharing one execute wrapper with the write
+metrics.
+"""
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.template.backends import django as django_backend
+
+from .query_observers import aobserve_queries, observe_queries
+
+logger = logging.getLogger('shop_app.timing')
+
+_current = ContextVar('shop_request_timings', default=None)
+
+_MISSING = object()
+
+class RequestTimings:
+    """What one request spent its time on; times are in seconds"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def count_query(self, sql, seconds):
+        self.queries += 1
+        self.db_time += seconds
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.total * 1000, 1),
+            'db_queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 1),
+            'template_ms': round(self.template_time * 1000, 1),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+    def server_timing(self):
+        """The Server-Timing header value"""
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f};desc="Templates"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'total;dur={self.total * 1000:.1f};desc="Total"',
+        ])
+
+@contextmanager
+def count_cache_lookups(cache, timings):
+    """Count hits and misses of cache.get()/get_many() (and their async versions) on one cache"""
+    get, get_many = cache.get, cache.get_many
+    # The default get_many() calls get() for each key, which is counted already
+    count_get_many = type(cache).get_many is not BaseCache.get_many
+
+    def counting_get(key, default=None, version=None):
+        value = get(key, _MISSING, version=version)
+        if value is _MISSING:
+            timings.cache_misses += 1
+            return default
+        timings.cache_hits += 1
+        return value
+
+    def counting_get_many(keys, version=None):
+        keys = list(keys)
+        found = get_many(keys, version=version)
+        timings.cache_hits += len(found)
+        timings.cache_misses += len(keys) - len(found)
+        return found
+
+    # Cache instances are per thread, so shadowing the methods only affects this request
+    cache.get = counting_get
+    if count_get_many:
+        cache.get_many = counting_get_many
+    try:
+        yield
+    finally:
+        del cache.get
+        if count_get_many:
+            del cache.get_many
+
+def wrap_caches(timings):
+    """Context manager counting the lookups on every configured cache"""
+    stack = ExitStack()
+    for cache in caches.all():
+        stack.enter_context(count_cache_lookups(cache, timings))
+    return stack
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None or timings.rendering:
+            return super().render(context, request)
+        timings.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.rendering = False
+            timings.template_time += time.perf_counter() - started
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, timing every template rendered for an instrumented request"""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except django_backend.TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '-'
+
+class ServerTimingMiddleware:
+    """Record timings for a sample of requests; list it first so it covers the other middleware"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        if not self.sampled():
+            return self.report(request, self.get_response(request), timings, sampled=False)
+        token = _current.set(timings)
+        try:
+            with wrap_caches(timings), observe_queries(timings.count_query):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        if not self.sampled():
+            return self.report(request, await self.get_response(request), timings, sampled=False)
+        token = _current.set(timings)
+        try:
+            with wrap_caches(timings):
+                async with aobserve_queries(timings.count_query):
+                    response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, timings)
+
+    def sampled(self):
+        rate = settings.SHOP_TIMING_SAMPLE_RATE
+        return rate >= 1 or random.random() < rate
+
+    def report(self, request, response, timings, sampled=True):
+        timings.finish()
+        slow = timings.total * 1000 >= settings.SHOP_TIMING_SLOW_MS
+        if not (sampled or slow):
+            return response
+
+        # Unsampled requests only know their total time
+        values = timings.as_dict() if sampled else {'total_ms': round(timings.total * 1000, 1)}
+        values = {'view': view_name(request), 'method': request.method, 'status': response.status_code, **values}
+        logger.log(
+            logging.WARNING if slow else logging.INFO,
+            ' '.join(f'{key}={value}' for key, value in values.items()),
+            extra={'timing': values},
+        )
+        if sampled and settings.SHOP_TIMING_HEADER:
+            response['Server-Timing'] = timings.server_timing()
+        return response
@@ -7,11 +7,13 @@ urlpatterns = [
     # Home and product pages
     path('', views.home, name='home'),
     path('products/', views.product_list, name='product_list'),
+    path('api/products/', views.product_feed, name='product_feed'),
     path('product/<slug:slug>/', views.product_detail, name='product_detail'),
     path('category/<slug:slug>/', views.category_detail, name='category_detail'),
     
     # Cart functionality
     path('cart/', views.cart_view, name='cart'),
+    path('cart/summary/', views.cart_summary, name='cart_summary'),
     path('add-to-cart/', views.add_to_cart, name='add_to_cart'),
     path('update-cart-item/', views.update_cart_item, name='update_cart_item'),
     path('remove-from-cart/', views.remove_from_cart, name='remove_from_cart'),
@@ -1,99 +1,113 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
-from django.db.models import Q
 from django.core.paginator import Paginator
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import UserCreationForm
+from django.conf import settings
+from django.core.cache import cache
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.static import serve
 from .models import *
 from .forms import *
+from .cart import get_cart, get_cart_backend, refresh_cart_summary
+from .pricing import priced_cart_items
+from .catalog import PRODUCTS_PER_PAGE, REVIEWS_PER_PAGE, filter_products, nearby_page_numbers, sort_products
+from .pagination import InvalidCursor, paginate_by_cursor
+from .facets import get_facets
+from .recommendations import recommended_products
+from .templatetags.shop_tags import product_cards
+from .orders import OrderError, place_order
+from .caching import catalog_cache_key
+from .conditional import (
+    category_detail_etag, category_detail_last_modified, order_detail_etag,
+    product_detail_etag, product_detail_last_modified,
+)
+from .storage import IMMUTABLE_CACHE_CONTROL, is_content_addressed
 import json
 
 def home(request):
     """Home page with featured products and categories"""
-    featured_products = Product.objects.filter(is_featured=True, is_active=True)[:8]
-    categories = Category.objects.all()[:6]
-    latest_products = Product.objects.filter(is_active=True).order_by('-created_at')[:8]
-    
-    context = {
-        'featured_products': featured_products,
-        'categories': categories,
-        'latest_products': latest_products,
-    }
+    cache_key = catalog_cache_key('home_context')
+    context = cache.get(cache_key)
+    if context is None:
+        context = {
+            'featured_products': list(Product.objects.for_listing().filter(is_featured=True, is_active=True)[:8]),
+            'categories': list(Category.objects.all()[:6]),
+            'latest_products': list(Product.objects.for_listing().filter(is_active=True).order_by('-created_at')[:8]),
+        }
+        cache.set(cache_key, context, settings.SHOP_HOME_CACHE_TIMEOUT)
     return render(request, 'shop_app/home.html', context)
 
 def product_list(request):
     """Product listing page with filtering and search"""
-    products = Product.objects.filter(is_active=True)
-    
-    # Search functionality
-    search_query = request.GET.get('search', '')
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(category__name__icontains=search_query)
-        )
-    
-    # Category filter
-    category_slug = request.GET.get('category', '')
-    if category_slug:
-        products = products.filter(category__slug=category_slug)
-    
-    # Gender filter
-    gender = request.GET.get('gender', '')
-    if gender:
-        products = products.filter(gender=gender)
-    
-    # Price filter
-    min_price = request.GET.get('min_price', '')
-    max_price = request.GET.get('max_price', '')
-    if min_price:
-        products = products.filter(price__gte=min_price)
-    if max_price:
-        products = products.filter(price__lte=max_price)
-    
-    # Sort products
-    sort_by = request.GET.get('sort', 'newest')
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    elif sort_by == 'name':
-        products = products.order_by('name')
-    else:
-        products = products.order_by('-created_at')
+    products, filters = filter_products(request.GET)
     
     # Pagination
-    paginator = Paginator(products, 12)
+    paginator = Paginator(products, PRODUCTS_PER_PAGE)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
-    categories = Category.objects.all()
+    categories = list(Category.objects.all())
     
     context = {
         'products': page_obj,
+        'page_numbers': nearby_page_numbers(page_obj),
         'categories': categories,
-        'search_query': search_query,
-        'current_category': category_slug,
-        'current_gender': gender,
-        'min_price': min_price,
-        'max_price': max_price,
-        'sort_by': sort_by,
+        'facets': get_facets(request.GET, categories),
+        **filters,
     }
     return render(request, 'shop_app/product_list.html', context)
 
+def product_feed(request):
+    """Cursor-paginated product listing as JSON for infinite scroll"""
+    products, filters = filter_products(request.GET)
+    try:
+        page = paginate_by_cursor(
+            products,
+            filters['sort_by'],
+            cursor=request.GET.get('cursor'),
+            per_page=PRODUCTS_PER_PAGE,
+        )
+    except InvalidCursor as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'results': [
+            {
+                'id': product.id,
+                'name': product.name,
+                'url': reverse('shop:product_detail', args=[product.slug]),
+                'price': product.price,
+                'current_price': product.current_price,
+                'is_on_sale': product.is_on_sale,
+                'image': product.primary_image.image.url if product.primary_image else None,
+            }
+            for product in page
+        ],
+        'html': product_cards(page, 'listing'),
+        'next_cursor': page.next_cursor,
+        'has_next': page.has_next,
+    })
+
+@cache_control(no_cache=True)
+@condition(etag_func=product_detail_etag, last_modified_func=product_detail_last_modified)
 def product_detail(request, slug):
     """Product detail page"""
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    related_products = Product.objects.filter(
-        category=product.category,
-        is_active=True
-    ).exclude(id=product.id)[:4]
+    product = get_object_or_404(Product.objects.select_related('category'), slug=slug, is_active=True)
+    # Customers also bought, falling back to similar products for items that have not sold yet
+    related_products = list(recommended_products(product, ProductRecommendation.CO_PURCHASE))
+    if not related_products:
+        related_products = recommended_products(product, ProductRecommendation.SIMILAR)
     
     # Get reviews
-    reviews = product.reviews.all()
+    reviews = Paginator(product.reviews.select_related('user'), REVIEWS_PER_PAGE).get_page(
+        request.GET.get('reviews_page')
+    )
     
     context = {
         'product': product,
@@ -102,62 +116,50 @@ def product_detail(request, slug):
     }
     return render(request, 'shop_app/product_detail.html', context)
 
+@cache_control(no_cache=True)
+@condition(etag_func=category_detail_etag, last_modified_func=category_detail_last_modified)
 def category_detail(request, slug):
     """Category detail page"""
     category = get_object_or_404(Category, slug=slug)
-    products = Product.objects.filter(category=category, is_active=True)
+    products = sort_products(Product.objects.for_listing().filter(category=category, is_active=True), 'newest')
     
     # Pagination
-    paginator = Paginator(products, 12)
+    paginator = Paginator(products, PRODUCTS_PER_PAGE)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
     context = {
         'category': category,
         'products': page_obj,
+        'page_numbers': nearby_page_numbers(page_obj),
     }
     return render(request, 'shop_app/category_detail.html', context)
 
-def get_or_create_cart(request):
-    """Helper function to get or create cart"""
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        cart, created = Cart.objects.get_or_create(session_key=session_key, user=None)
-    return cart
+# The cart endpoints are async views: under ASGI they wait on the database
+# without tying up a worker thread. They still work under WSGI.
+MAX_CART_REQUEST_BYTES = 1024
+
+def cart_request_data(request):
+    """Parse the JSON body of a cart request; the ASGI handler has already read it without blocking"""
+    if len(request.body) > MAX_CART_REQUEST_BYTES:
+        raise ValueError('Request too large')
+    return json.loads(request.body)
 
-def add_to_cart(request):
+async def add_to_cart(request):
     """Add product to cart via AJAX"""
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
+            data = cart_request_data(request)
             product_id = data.get('product_id')
             quantity = int(data.get('quantity', 1))
             size = data.get('size', '')
             
-            product = get_object_or_404(Product, id=product_id, is_active=True)
-            cart = get_or_create_cart(request)
-            
-            # Check if item already exists in cart
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                size=size,
-                defaults={'quantity': quantity}
-            )
-            
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
-            
+            product = await aget_object_or_404(Product, id=product_id, is_active=True)
+            summary = await get_cart_backend().aadd_item(request, product, quantity, size)
             return JsonResponse({
                 'success': True,
                 'message': f'{product.name} added to cart!',
-                'cart_count': cart.items.count()
+                'cart_count': summary['item_count']
             })
             
         except Exception as e:
@@ -168,27 +170,20 @@ def add_to_cart(request):
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
-def update_cart_item(request):
+async def update_cart_item(request):
     """Update cart item quantity via AJAX"""
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
+            data = cart_request_data(request)
             item_id = data.get('item_id')
             quantity = int(data.get('quantity', 1))
             
-            cart_item = get_object_or_404(CartItem, id=item_id)
-            
-            if quantity <= 0:
-                cart_item.delete()
-                message = 'Item removed from cart'
-            else:
-                cart_item.quantity = quantity
-                cart_item.save()
-                message = 'Cart updated successfully'
-            
+            summary = await get_cart_backend().aupdate_item(request, item_id, quantity)
+            message = 'Item removed from cart' if quantity <= 0 else 'Cart updated successfully'
             return JsonResponse({
                 'success': True,
-                'message': message
+                'message': message,
+                'cart_count': summary['item_count']
             })
             
         except Exception as e:
@@ -199,19 +194,18 @@ def update_cart_item(request):
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
-def remove_from_cart(request):
+async def remove_from_cart(request):
     """Remove item from cart via AJAX"""
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
+            data = cart_request_data(request)
             item_id = data.get('item_id')
             
-            cart_item = get_object_or_404(CartItem, id=item_id)
-            cart_item.delete()
-            
+            summary = await get_cart_backend().aremove_item(request, item_id)
             return JsonResponse({
                 'success': True,
-                'message': 'Item removed from cart'
+                'message': 'Item removed from cart',
+                'cart_count': summary['item_count']
             })
             
         except Exception as e:
@@ -222,68 +216,48 @@ def remove_from_cart(request):
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
+async def cart_summary(request):
+    """Cart item count, quantity total and subtotal as JSON"""
+    summary = await get_cart_backend().asummary(request)
+    return JsonResponse({
+        'item_count': summary['item_count'],
+        'total_quantity': summary['total_quantity'],
+        'subtotal': summary['subtotal'],
+    })
+
 def cart_view(request):
     """Shopping cart page"""
-    cart = get_or_create_cart(request)
-    cart_items = cart.items.all()
-    
-    # Calculate totals
-    subtotal = sum(item.total_price for item in cart_items)
-    shipping = 0 if subtotal > 1000 else 100  # Free shipping over ₹1000
-    total = subtotal + shipping
+    backend = get_cart_backend()
+    cart_items = backend.items(request)
+    totals = backend.summary(request, refresh=True)
     
     context = {
         'cart_items': cart_items,
-        'subtotal': subtotal,
-        'shipping': shipping,
-        'total': total,
+        'subtotal': totals['subtotal'],
+        'shipping': totals['shipping'],
+        'total': totals['total'],
     }
     return render(request, 'shop_app/cart.html', context)
 
 @login_required
 def checkout(request):
     """Checkout page"""
-    cart = get_or_create_cart(request)
-    cart_items = cart.items.all()
+    cart = get_cart(request)
+    totals = refresh_cart_summary(request, cart)
     
-    if not cart_items.exists():
+    if not totals['item_count']:
         messages.warning(request, 'Your cart is empty!')
         return redirect('shop:cart')
     
-    # Calculate totals
-    subtotal = sum(item.total_price for item in cart_items)
-    shipping = 0 if subtotal > 1000 else 100
-    total = subtotal + shipping
-    
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            # Create order
-            order = Order.objects.create(
-                user=request.user,
-                total_amount=total,
-                shipping_address=form.cleaned_data['shipping_address'],
-                shipping_city=form.cleaned_data['shipping_city'],
-                shipping_state=form.cleaned_data['shipping_state'],
-                shipping_zip=form.cleaned_data['shipping_zip'],
-                shipping_country=form.cleaned_data['shipping_country'],
-                phone=form.cleaned_data['phone'],
-                payment_method=form.cleaned_data['payment_method'],
-                notes=form.cleaned_data['notes'],
-            )
-            
-            # Create order items
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.current_price,
-                    size=cart_item.size,
-                )
-            
-            # Clear cart
-            cart.delete()
+            try:
+                order = place_order(request.user, cart, form.cleaned_data)
+            except OrderError as e:
+                messages.error(request, str(e))
+                return redirect('shop:cart')
+            refresh_cart_summary(request, None)
             
             messages.success(request, f'Order placed successfully! Order ID: {order.order_id}')
             return redirect('shop:order_confirmation', order_id=order.order_id)
@@ -304,10 +278,10 @@ def checkout(request):
             form = CheckoutForm()
     
     context = {
-        'cart_items': cart_items,
-        'subtotal': subtotal,
-        'shipping': shipping,
-        'total': total,
+        'cart_items': priced_cart_items(cart).select_related('product'),
+        'subtotal': totals['subtotal'],
+        'shipping': totals['shipping'],
+        'total': totals['total'],
         'form': form,
     }
     return render(request, 'shop_app/checkout.html', context)
@@ -316,7 +290,10 @@ def checkout(request):
 def order_confirmation(request, order_id):
     """Order confirmation page"""
     order = get_object_or_404(Order, order_id=order_id, user=request.user)
-    return render(request, 'shop_app/order_confirmation.html', {'order': order})
+    items = order.items.select_related('product__category').prefetch_related(
+        primary_image_prefetch('product__images')
+    )
+    return render(request, 'shop_app/order_confirmation.html', {'order': order, 'items': items})
 
 @login_required
 def order_history(request):
@@ -325,6 +302,8 @@ def order_history(request):
     return render(request, 'shop_app/order_history.html', {'orders': orders})
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=order_detail_etag)
 def order_detail(request, order_id):
     """Order detail page"""
     order = get_object_or_404(Order, order_id=order_id, user=request.user)
@@ -386,3 +365,10 @@ def add_review(request, product_id):
         'form': form,
         'product': product
     })
+
+def serve_media(request, path):
+    """Development media server; content-addressed files are marked immutable"""
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_content_addressed(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response